@@ -3,11 +3,34 @@ import numpy as np
 import pyodbc
 import warnings
 import os
+import json
+import logging
+import logging.handlers
+import sqlite3
 import shutil
 import tempfile
 import openpyxl
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import time
+import threading
+import uuid
+import hashlib
+import glob
+import importlib
+import sys
+import cProfile
+import pstats
+import io
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturoTimeout
+from pathlib import Path
+from dataclasses import astuple, dataclass
+from datetime import date
+from errores import FuenteNoDisponible  # módulo aparte: la clase no cambia entre reruns
 
 # --- 1. CONFIGURACION DE LA APP ---
 st.set_page_config(
@@ -18,119 +41,761 @@ st.set_page_config(
 )
 
 warnings.filterwarnings('ignore')
+# Copy-on-Write (por defecto desde pandas 3): seleccionar, renombrar o filtrar columnas de un DataFrame
+# compartido no copia datos hasta que alguien escribe, y esa escritura nunca toca al original.
+if int(pd.__version__.split('.')[0]) < 3: pd.set_option('mode.copy_on_write', True)
 
 # --- CONSTANTES ---
-PATH_EXCEL_ORIGEN = r"O:\TALLERES 2\Proyectado de 6 meses.xlsx"
+PATH_EXCEL_ORIGEN = os.environ.get("BROGAS_EXCEL", r"O:\TALLERES 2\Proyectado de 6 meses.xlsx")
+BASE_LOCAL = os.environ.get("BROGAS_BASE_LOCAL")  # carpeta generada por base_local.py; reemplaza a los DSN
 FECHA_FILTRO_BROGAS = '2024-12-01'
 FECHA_FILTRO_ML = '2025-09-01'
+TIPOS_COMPROBANTE = ('FA', 'FB', 'FCA', 'FE')
+
+TTL_SQL = 600                    # segundos de vida de un resultado en caché
+TTL_SQL_DEGRADADO = 60           # ídem cuando alguna fuente se sirvió desde su último dato bueno
+CACHE_SQL_MAX_BYTES = 256 * 1024 * 1024
+CACHE_SQL_MAX_ENTRADAS = 16
+TTL_DETALLE_OP = 300             # detalle de órdenes por artículo (drill-down de Producción)
+DETALLE_OP_MAX_ARTICULOS = 200
+DETALLE_OP_MAX_BYTES = 32 * 1024 * 1024
+
+TIMEOUT_CONEXION = 5             # segundos para conectar a un DSN
+TIMEOUT_CONSULTA = 120           # segundos máximos por sentencia
+LATENCIA_MAX_FUENTES = 30        # un refresco no espera más que esto a las fuentes; las que no llegan van con su último dato bueno
+FALLOS_PARA_ABRIR = 2            # fallos seguidos que abren el circuito de un DSN
+ESPERA_CIRCUITO = 30             # segundos sin llamar a un DSN abierto; se duplica con cada fallo nuevo
+ESPERA_CIRCUITO_MAX = 600
+
+UMBRAL_CONSULTA_LENTA = float(os.environ.get("BROGAS_UMBRAL_LENTA", "2.0"))  # segundos; por encima se captura el plan
+LOG_CONSULTAS_MAX = 500          # entradas que se conservan en memoria
+DIR_LOGS = os.environ.get("BROGAS_LOGS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs"))
+
+DIR_ESPEJO = os.environ.get("BROGAS_ESPEJO", os.path.join(tempfile.gettempdir(), "brogas_espejo"))
+INTERVALO_ESPEJO = 30            # segundos entre verificaciones del Excel en el recurso compartido
+ESPERA_ESPEJO = 15               # segundos que "Actualizar" espera al vigilante antes de seguir con el espejo
+
+DIR_SNAPSHOTS = os.environ.get("BROGAS_SNAPSHOTS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots"))
+MAX_SNAPSHOTS = 100
+TOP_CAMBIOS = 25                 # filas de "mayores variaciones" en la vista de Cambios
+
+# Bandas de cobertura (las mismas que colorea style_cobertura)
+UMBRAL_CRITICO = 1.0
+UMBRAL_BAJO = 2.0
+COBERTURA_EXCESO = 100           # desde acá no se colorea (incluye el 999 de "sin proyección")
+BANDAS_COBERTURA = ['🔴 ≤1 mes', '🟠 ≤2 meses', '🟢 OK', '⚪ ≥100 / sin proy.']
+
+API_PUERTO = os.environ.get("BROGAS_API_PUERTO")  # sin valor no se levanta la API HTTP
+API_HOST = os.environ.get("BROGAS_API_HOST", "127.0.0.1")  # la API no tiene autenticación: "0.0.0.0" solo a conciencia
+API_CACHE_RESPUESTAS = 64        # cuerpos ya serializados (por versión de datos) que se guardan
+
+PERFILAR = os.environ.get("BROGAS_PERFIL", "0") != "0"  # perfila el primer rerun de cada sesión; a pedido: ?perfil=1 en la URL
+DIR_PERFILES = os.environ.get("BROGAS_PERFILES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "perfiles"))
+INTERVALO_MUESTREO = 0.005       # segundos entre muestras de pila para el flame graph
+TOP_PERFIL = 30                  # funciones en el resumen de texto
+MAX_PERFILES = 50                # perfiles guardados (cada uno .prof/.folded/.txt); los más viejos se borran
+
+DIR_ALERTAS = os.environ.get("BROGAS_ALERTAS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "alertas"))
+NOTIFICADOR_ALERTAS = os.environ.get("BROGAS_NOTIFICADOR")  # "modulo:funcion"; recibe la lista de alertas nuevas
+
+# --- CONSULTAS (con parámetros ligados: el texto SQL no cambia y el plan se reutiliza) ---
+Q_ART = "SELECT A.CODIGOPARTICULAR, A.DESCRIPCION, SUM(C.STOCKACTUAL) as STOCK FROM ARTICULOS A LEFT JOIN CASILLEROS C ON A.CODIGOARTICULO = C.CODIGOARTICULO LEFT JOIN DEPOSITOS D ON C.CODIGODEPOSITO = D.CODIGODEPOSITO WHERE D.DESCRIPCION NOT IN ('COMPRAS NC','ALUCOLOR','ECOMMERCE_FULL_BRO','ECOMMERCE_FULL_1','CONTROL DE CALIDAD', 'SALDOS','ECOMMERCE_FACTURACIÓN', 'ECOMMERCE_STOCK', 'SCRAP', 'SERVICIO TECNICO', 'SHOWROOM', 'M. NO CONFORMES') GROUP BY A.CODIGOPARTICULAR, A.DESCRIPCION"
+Q_VENTAS = "SELECT CODIGOPARTICULAR, SUM(CANTIDAD - CANTIDADREMITIDA) as PENDIENTES_VENTAS FROM CUERPOCOMPROBANTES WHERE FECHAMODIFICACION > ? AND TIPOCOMPROBANTE IN ({tipos}) AND (CANTIDAD - CANTIDADREMITIDA) > 0 GROUP BY CODIGOPARTICULAR"
+Q_PEDIDOS = "SELECT CP.CODIGOPARTICULAR, SUM(CP.CANTIDAD) as PEDIDOS_NUEVOS FROM CUERPOPEDIDOS CP INNER JOIN CABEZAPEDIDOS CB ON CP.NUMEROCOMPROBANTE = CB.NUMEROCOMPROBANTE AND CP.TIPOCOMPROBANTE = CB.TIPOCOMPROBANTE INNER JOIN DEPOSITOS D ON CP.CODIGODEPOSITO = D.CODIGODEPOSITO WHERE CB.ANULADA = 0 AND CP.CANTIDADCANCELADA = 0 AND CP.CANTIDADREMITIDA = 0 AND CP.CANTIDADPREPARADA = 0 AND D.DESCRIPCION IN ('EXPEDICION', 'FIZBAY') GROUP BY CP.CODIGOPARTICULAR"
+# Órdenes abiertas: no anuladas y no terminadas. Q_OP parte de esta lista y llega a PRODCUERPOORDEN y a
+# PRODDETALLEFINALIZACIONORDEN por sus índices de CODIGOORDEN, así que solo lee las líneas y finalizaciones
+# de órdenes abiertas; el histórico de órdenes cerradas, que crece sin límite, no se recorre.
+Q_OP_ABIERTAS = "SELECT HA.CODIGOORDEN FROM PRODCABEZAORDEN HA LEFT JOIN ESTADOSORDENPRODUCCION EA ON HA.CODIGOESTADOOP = EA.CODIGOESTADOOP WHERE HA.ANULADA = 0 AND COALESCE(EA.DESCRIPCION, '') <> 'TERMINADO'"
+Q_OP = f"SELECT A.CODIGOPARTICULAR, SUM(CP.CANTIDAD) as CANTIDAD_TOTAL_OP, SUM(CP.CANTIDAD - COALESCE(ENTREGAS.TOTAL_ENTREGADO, 0)) as EN_PRODUCCION FROM PRODCUERPOORDEN CP INNER JOIN ARTICULOS A ON CP.CODIGOARTICULO = A.CODIGOARTICULO LEFT JOIN (SELECT F.CODIGOORDEN, F.CODIGOARTICULO, SUM(F.CANTIDAD) as TOTAL_ENTREGADO FROM PRODDETALLEFINALIZACIONORDEN F WHERE F.CODIGOORDEN IN ({Q_OP_ABIERTAS}) GROUP BY F.CODIGOORDEN, F.CODIGOARTICULO) ENTREGAS ON CP.CODIGOORDEN = ENTREGAS.CODIGOORDEN AND CP.CODIGOARTICULO = ENTREGAS.CODIGOARTICULO WHERE CP.CODIGOORDEN IN ({Q_OP_ABIERTAS}) AND (CP.CANTIDAD - COALESCE(ENTREGAS.TOTAL_ENTREGADO, 0)) > 0 GROUP BY A.CODIGOPARTICULAR"
+# Órdenes abiertas de un solo artículo, mismos filtros que Q_OP. Parte de ARTICULOS por CODIGOPARTICULAR
+# y filtra PRODCUERPOORDEN / PRODDETALLEFINALIZACIONORDEN por CODIGOARTICULO, así que usa sus índices
+# en vez de agregar la tabla de finalizaciones completa.
+Q_OP_DETALLE = "SELECT H.CODIGOORDEN, COALESCE(E.DESCRIPCION, '') as ESTADO, CP.CANTIDAD as CANTIDAD_OP, COALESCE(ENTREGAS.TOTAL_ENTREGADO, 0) as ENTREGADO, COALESCE(ENTREGAS.ENTREGAS, 0) as ENTREGAS_PARCIALES, CP.CANTIDAD - COALESCE(ENTREGAS.TOTAL_ENTREGADO, 0) as SALDO_PENDIENTE FROM ARTICULOS A INNER JOIN PRODCUERPOORDEN CP ON CP.CODIGOARTICULO = A.CODIGOARTICULO INNER JOIN PRODCABEZAORDEN H ON H.CODIGOORDEN = CP.CODIGOORDEN LEFT JOIN (SELECT F.CODIGOORDEN, F.CODIGOARTICULO, SUM(F.CANTIDAD) as TOTAL_ENTREGADO, COUNT(*) as ENTREGAS FROM PRODDETALLEFINALIZACIONORDEN F INNER JOIN ARTICULOS AF ON F.CODIGOARTICULO = AF.CODIGOARTICULO WHERE AF.CODIGOPARTICULAR = ? GROUP BY F.CODIGOORDEN, F.CODIGOARTICULO) ENTREGAS ON CP.CODIGOORDEN = ENTREGAS.CODIGOORDEN AND CP.CODIGOARTICULO = ENTREGAS.CODIGOARTICULO LEFT JOIN ESTADOSORDENPRODUCCION E ON H.CODIGOESTADOOP = E.CODIGOESTADOOP WHERE A.CODIGOPARTICULAR = ? AND H.ANULADA = 0 AND COALESCE(E.DESCRIPCION, '') <> 'TERMINADO' AND (CP.CANTIDAD - COALESCE(ENTREGAS.TOTAL_ENTREGADO, 0)) > 0 ORDER BY H.CODIGOORDEN"
+Q_CANAL = "SELECT CODIGOPARTICULAR, SUM(CANTIDAD - CANTIDADREMITIDA) as PENDIENTE FROM CUERPOCOMPROBANTES WHERE FECHAMODIFICACION > ? GROUP BY CODIGOPARTICULAR"
+Q_CANAL_FACTURAS = "SELECT CODIGOPARTICULAR, SUM(CANTIDAD - CANTIDADREMITIDA) as PENDIENTE FROM CUERPOCOMPROBANTES WHERE FECHAMODIFICACION > ? AND TIPOCOMPROBANTE IN ({tipos}) AND (CANTIDAD - CANTIDADREMITIDA) > 0 GROUP BY CODIGOPARTICULAR"
+
+CONSULTAS_PRINCIPAL = ('q_art', 'q_ventas', 'q_pedidos', 'q_op')
+CONSULTAS_CANAL = ('q_canal', 'q_canal_facturas')
+
+# --- FUENTES DE DATOS ---
+# Registro declarativo de DSN. La fuente 'principal' (una sola) aporta stock, ventas, pedidos
+# y producción; cada fuente 'canal' (e-commerce, sucursales, otras empresas con el mismo
+# CUERPOCOMPROBANTES) aporta pendientes que se suman al total en su propia columna
+# PENDIENTE_<nombre>. Se puede reemplazar con un fuentes.json con la misma estructura.
+FUENTES_POR_DEFECTO = [
+    {'nombre': 'BROGAS', 'dsn': 'BROGAS', 'rol': 'principal', 'consultas': list(CONSULTAS_PRINCIPAL)},
+    {'nombre': 'ML', 'dsn': 'BROGASML', 'rol': 'canal', 'consultas': ['q_canal'], 'desde': FECHA_FILTRO_ML},
+]
+PATH_FUENTES = os.environ.get("BROGAS_FUENTES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fuentes.json"))
+
+def cargar_fuentes():
+    if not os.path.exists(PATH_FUENTES): return FUENTES_POR_DEFECTO
+    try:
+        with open(PATH_FUENTES, encoding='utf-8') as f:
+            fuentes = json.load(f)
+        for fu in fuentes:
+            permitidas = CONSULTAS_PRINCIPAL if fu['rol'] == 'principal' else CONSULTAS_CANAL
+            if fu['rol'] not in ('principal', 'canal') or not fu['dsn'] or not fu['nombre']:
+                raise ValueError(f"fuente mal definida: {fu}")
+            if any(c not in permitidas for c in fu['consultas']):
+                raise ValueError(f"{fu['nombre']}: consultas permitidas para rol {fu['rol']}: {', '.join(permitidas)}")
+            if fu['rol'] == 'canal': date.fromisoformat(fu.get('desde', FECHA_FILTRO_ML))
+        if sum(fu['rol'] == 'principal' for fu in fuentes) != 1:
+            raise ValueError("debe haber exactamente una fuente con rol 'principal'")
+        if len({fu['nombre'] for fu in fuentes}) != len(fuentes):
+            raise ValueError("nombres de fuente repetidos")
+        return fuentes
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        st.error(f"Registro de fuentes inválido ({PATH_FUENTES}): {e}. Se usan las fuentes por defecto.")
+        return FUENTES_POR_DEFECTO
+
+FUENTES = cargar_fuentes()
+FUENTE_PRINCIPAL = next(fu for fu in FUENTES if fu['rol'] == 'principal')
+FUENTES_CANAL = [fu for fu in FUENTES if fu['rol'] == 'canal']
+COLUMNAS_CANAL = [f"PENDIENTE_{fu['nombre'].upper()}" for fu in FUENTES_CANAL]
+
+@dataclass(frozen=True)
+class ParametrosConsulta:
+    """Valores ligados a las consultas. Inmutable; astuple() da la clave de caché."""
+    fecha_ventas: date = date.fromisoformat(FECHA_FILTRO_BROGAS)
+    tipos_comprobante: tuple = TIPOS_COMPROBANTE
+    fechas_canal: tuple = ()  # pares (nombre de fuente, fecha); sin valor se usa 'desde' del registro
+
+    def fecha_canal(self, fuente):
+        return dict(self.fechas_canal).get(fuente['nombre']) or date.fromisoformat(fuente.get('desde', FECHA_FILTRO_ML))
+
+def parametros_por_defecto():
+    """Los parámetros que arma la barra lateral sin tocar nada (misma clave de caché que la interfaz)."""
+    return ParametrosConsulta(fechas_canal=tuple((fu['nombre'], ParametrosConsulta().fecha_canal(fu)) for fu in FUENTES_CANAL))
 
 # --- 2. GESTIÓN DE CACHÉ Y CONEXIONES ---
 
 def conectar_odbc(dsn):
     try:
-        return pyodbc.connect(f"DSN={dsn};Uid=SYSDBA;Pwd=masterkey", timeout=10)
+        if BASE_LOCAL:
+            # Sustituto local: un SQLite por DSN con el mismo esquema, abierto en solo lectura
+            path = Path(BASE_LOCAL, f"{dsn}.sqlite").resolve()
+            sqlite3.register_adapter(date, date.isoformat)
+            return sqlite3.connect(f"{path.as_uri()}?mode=ro", uri=True, check_same_thread=False)
+        # autocommit: la conexión es persistente y no debe dejar una transacción abierta en Firebird
+        conn = pyodbc.connect(f"DSN={dsn};Uid=SYSDBA;Pwd=masterkey", timeout=TIMEOUT_CONEXION, autocommit=True)
+        conn.timeout = TIMEOUT_CONSULTA
+        return conn
     except Exception as e:
         st.error(f"❌ Error conectando a {dsn}: {e}")
         return None
 
-@st.cache_data(ttl=3600, show_spinner="Leyendo Excel Proyectado...")
+def parsear_proyectado(path_lectura):
+    """Lee la tabla PROYECTADO_2 del libro y devuelve CODIGOPARTICULAR, DESCRIPCION, PEDIDO_PROYECTADO."""
+    wb = openpyxl.load_workbook(path_lectura, data_only=True, read_only=False)
+    res_data = None
+    for sheet in wb.worksheets:
+        if "PROYECTADO_2" in sheet.tables:
+            tbl = sheet.tables["PROYECTADO_2"]
+            rango = tbl.ref
+            # CORRECCIÓN PYLANCE: Extracción limpia de valores
+            data = []
+            for row in sheet[rango]:
+                data.append([cell.value for cell in row]) # type: ignore
+            
+            if len(data) > 1:
+                res_data = pd.DataFrame(data[1:], columns=data[0])
+            break
+    wb.close()
+
+    if res_data is None: return pd.DataFrame()
+
+    df = res_data
+    df.columns = df.columns.astype(str).str.strip()
+    meses = ['MES2', 'MES3', 'MES4']
+    for m in meses:
+        if m in df.columns:
+            df[m] = pd.to_numeric(df[m], errors='coerce').fillna(0)
+        else:
+            df[m] = 0
+    
+    df['PEDIDO_PROYECTADO'] = df[meses].sum(axis=1)
+    col_cod = 'Codigo' if 'Codigo' in df.columns else df.columns[0]
+    col_des = 'Descripción' if 'Descripción' in df.columns else (df.columns[1] if len(df.columns) > 1 else 'Descripción')
+    
+    df = df[[col_cod, col_des, 'PEDIDO_PROYECTADO']].rename(columns={col_cod: 'CODIGOPARTICULAR', col_des: 'DESCRIPCION'})
+    df['CODIGOPARTICULAR'] = df['CODIGOPARTICULAR'].astype(str).str.strip().str.upper()
+    return df
+
+def hash_archivo(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b''): h.update(bloque)
+    return h.hexdigest()
+
+class EspejoProyectado:
+    """Copia local del Excel de proyección que solo se renueva cuando el origen cambia.
+
+    Un hilo revisa el recurso compartido cada INTERVALO_ESPEJO segundos: si tamaño y mtime
+    no cambiaron no se copia nada; si cambiaron se copia y se compara el SHA-256, y solo
+    un contenido distinto se vuelve a parsear. Si el recurso está lento, caído o el archivo
+    bloqueado, se sigue sirviendo la última proyección buena (también después de reiniciar,
+    desde la copia en DIR_ESPEJO).
+    """
+
+    def __init__(self, origen=PATH_EXCEL_ORIGEN, dir_espejo=DIR_ESPEJO, intervalo=INTERVALO_ESPEJO):
+        self.origen = origen
+        self.intervalo = intervalo
+        self.path_espejo = os.path.join(dir_espejo, "proyectado.xlsx")
+        self.path_meta = os.path.join(dir_espejo, "proyectado.json")
+        self.df = None                # última proyección buena; se reemplaza, nunca se modifica
+        self.firma = None             # {'tamano', 'mtime_ns', 'sha256'} del origen que generó self.df
+        self.error = None             # último problema con el origen (None si está al día)
+        self.actualizado = None       # instante del último parseo
+        self.verificado = None        # instante de la última verificación sin problemas
+        self.lock = threading.Lock()  # serializa verificaciones, los lectores no esperan
+        self.despertar = threading.Event()
+        self.vueltas = 0              # verificaciones terminadas por el vigilante
+        self.terminada = threading.Condition()
+        try:
+            os.makedirs(dir_espejo, exist_ok=True)
+            self.cargar_espejo_local()
+        except Exception as e:
+            self.error = f"Espejo local ilegible: {e}"
+        if self.df is None: self.verificar()  # sin espejo previo no hay nada que servir: se espera al origen
+        threading.Thread(target=self.vigilar, daemon=True, name="espejo-proyectado").start()
+
+    def cargar_espejo_local(self):
+        if not (os.path.exists(self.path_espejo) and os.path.exists(self.path_meta)): return
+        with open(self.path_meta, encoding='utf-8') as f:
+            firma = json.load(f)
+        # Un espejo de otro origen (BROGAS_EXCEL cambió, o uno viejo sin origen registrado) no se sirve
+        if firma.pop('origen', None) != self.origen: return
+        self.df = parsear_proyectado(self.path_espejo)
+        self.firma = firma
+        self.actualizado = os.path.getmtime(self.path_meta)
+
+    def guardar_meta(self):
+        with open(self.path_meta, 'w', encoding='utf-8') as f:
+            json.dump({**self.firma, 'origen': self.origen}, f)
+
+    def vigilar(self):
+        while True:
+            self.despertar.wait(self.intervalo)
+            self.despertar.clear()
+            self.verificar()
+            with self.terminada:
+                self.vueltas += 1
+                self.terminada.notify_all()
+
+    def pedir_verificacion(self, espera=ESPERA_ESPEJO):
+        """Despierta al vigilante y espera hasta `espera` s a que verifique. La sesión nunca toca el recurso
+        compartido: si está lento o colgado devuelve False y se sigue sirviendo el espejo."""
+        with self.terminada:
+            # Una verificación ya en curso pudo leer el origen antes del pedido: se espera la siguiente
+            objetivo = self.vueltas + (2 if self.lock.locked() else 1)
+            self.despertar.set()
+            return self.terminada.wait_for(lambda: self.vueltas >= objetivo, timeout=espera)
+
+    def verificar(self):
+        with self.lock:
+            try:
+                stat = os.stat(self.origen)
+            except OSError as e:
+                self.error = f"No se encuentra el archivo: {self.origen} ({e})"
+                return
+            firma = {'tamano': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            if self.df is not None and self.firma and all(self.firma.get(k) == v for k, v in firma.items()):
+                self.error, self.verificado = None, time.time()
+                return
+
+            tmp = self.path_espejo.replace(".xlsx", ".tmp.xlsx")  # openpyxl exige la extensión
+            try:
+                shutil.copy2(self.origen, tmp)
+            except PermissionError as e:
+                if self.df is None:
+                    # Sin copia previa: como siempre, se lee el original bloqueado directamente
+                    try: self.df, self.actualizado = parsear_proyectado(self.origen), time.time()
+                    except Exception as e2: self.error = f"Error procesando Excel: {e2}"
+                    return
+                self.error = f"Excel bloqueado, se reintenta en {self.intervalo} s ({e})"
+                return
+            except OSError as e:
+                self.error = f"No se pudo copiar {self.origen}: {e}"
+                return
+
+            try:
+                firma['sha256'] = hash_archivo(tmp)
+                if self.df is not None and self.firma and self.firma.get('sha256') == firma['sha256']:
+                    os.remove(tmp)  # guardado sin cambios de contenido: no se vuelve a parsear
+                else:
+                    df = parsear_proyectado(tmp)
+                    os.replace(tmp, self.path_espejo)
+                    self.df, self.actualizado = df, time.time()
+                self.firma = firma
+                self.guardar_meta()
+                self.error, self.verificado = None, time.time()
+            except Exception as e:
+                self.error = f"Error procesando Excel: {e}"
+                try: os.remove(tmp)
+                except: pass
+
+@st.cache_resource(show_spinner="Leyendo Excel Proyectado...")
+def get_espejo_proyectado():
+    return EspejoProyectado()
+
 def get_proyectado_optimizado():
-    if not os.path.exists(PATH_EXCEL_ORIGEN):
-        st.error(f"No se encuentra el archivo: {PATH_EXCEL_ORIGEN}")
+    """Última proyección buena del espejo local. Compartida entre sesiones: no mutarla."""
+    espejo = get_espejo_proyectado()
+    if espejo.df is None:
+        st.error(espejo.error or f"No se encuentra el archivo: {PATH_EXCEL_ORIGEN}")
         return pd.DataFrame()
+    return espejo.df
+
+class RegistroConsultas:
+    """Log rodante de consultas: duración, filas, columnas y bytes de cada ejecución.
+
+    Se guarda en memoria (últimas LOG_CONSULTAS_MAX) y en DIR_LOGS/consultas.log como
+    JSON por línea, rotando por tamaño. Las consultas que superan el umbral llevan su plan.
+    """
+
+    def __init__(self, umbral=UMBRAL_CONSULTA_LENTA, maximo=LOG_CONSULTAS_MAX):
+        self.umbral = umbral
+        self.entradas = deque(maxlen=maximo)
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("brogas.consultas")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            try:
+                os.makedirs(DIR_LOGS, exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    os.path.join(DIR_LOGS, "consultas.log"), maxBytes=5 * 1024 * 1024, backupCount=3, encoding="utf-8")
+                self.logger.addHandler(handler)
+            except OSError:
+                pass  # sin carpeta de logs escribible queda solo el registro en memoria
+
+    def registrar(self, entrada):
+        with self.lock:
+            self.entradas.append(entrada)
+        self.logger.info(json.dumps(entrada, default=str, ensure_ascii=False))
+
+    def resumen(self):
+        with self.lock:
+            df = pd.DataFrame(list(self.entradas))
+        if df.empty: return df
+        return (df.groupby(['dsn', 'consulta'])
+                  .agg(EJECUCIONES=('segundos', 'size'), SEG_P50=('segundos', 'median'), SEG_MAX=('segundos', 'max'),
+                       FILAS=('filas', 'last'), COLUMNAS=('columnas', 'last'), BYTES=('bytes', 'last'),
+                       LENTAS=('lenta', 'sum'), ULTIMA=('inicio', 'max'))
+                  .reset_index()
+                  .sort_values('SEG_MAX', ascending=False))
+
+    def lentas(self):
+        with self.lock:
+            return [e for e in self.entradas if e['lenta']]
+
+class CircuitoFuente:
+    """Circuit breaker de un DSN: tras FALLOS_PARA_ABRIR fallos seguidos deja de llamarlo.
+
+    Abierto, las consultas fallan al instante durante la espera (con backoff exponencial
+    hasta ESPERA_CIRCUITO_MAX). Vencida la espera se deja pasar una sola prueba: si anda se
+    cierra, si no vuelve a abrirse por más tiempo.
+    """
+
+    def __init__(self, umbral=FALLOS_PARA_ABRIR, espera=ESPERA_CIRCUITO, espera_max=ESPERA_CIRCUITO_MAX):
+        self.umbral = umbral
+        self.espera = espera
+        self.espera_max = espera_max
+        self.fallos = 0
+        self.abierto_hasta = 0.0
+        self.ultimo_error = None
+        self.lock = threading.Lock()
+
+    def espera_actual(self):
+        return min(self.espera * 2 ** max(self.fallos - self.umbral, 0), self.espera_max)
+
+    def permitir(self):
+        with self.lock:
+            ahora = time.monotonic()
+            if ahora < self.abierto_hasta: return False
+            if self.fallos >= self.umbral:
+                self.abierto_hasta = ahora + self.espera_actual()  # semiabierto: una prueba, el resto sigue cortado
+            return True
+
+    def exito(self):
+        with self.lock:
+            self.fallos, self.abierto_hasta, self.ultimo_error = 0, 0.0, None
+
+    def fallo(self, error):
+        with self.lock:
+            self.fallos += 1
+            self.ultimo_error = str(error)
+            if self.fallos >= self.umbral:
+                self.abierto_hasta = time.monotonic() + self.espera_actual()
+
+    def estado(self):
+        if self.fallos < self.umbral: return 'cerrado'
+        return 'abierto' if time.monotonic() < self.abierto_hasta else 'semiabierto'
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
+    def descripcion(self):
+        if self.estado() == 'abierto':
+            return f"circuito abierto {self.abierto_hasta - time.monotonic():.0f} s más tras {self.fallos} fallos: {self.ultimo_error}"
+        return self.ultimo_error
+
+class ConexionPreparada:
+    """Conexión persistente a un DSN que guarda un cursor por texto SQL.
+
+    pyodbc reutiliza la sentencia preparada cuando el mismo SQL se ejecuta de nuevo
+    en el mismo cursor, así que Firebird solo prepara cada consulta una vez por conexión.
+    """
+
+    def __init__(self, dsn, registro=None):
+        self.dsn = dsn
+        self.registro = registro
+        self.circuito = CircuitoFuente()
+        self.conn = None
+        self.cursores = {}
+        self.lock = threading.Lock()
+
+    def consultar(self, sql, params=(), nombre=None, sesion=None):
+        """DataFrame con el resultado; FuenteNoDisponible si el circuito está abierto o no hay conexión."""
+        if not self.circuito.permitir():
+            raise FuenteNoDisponible(f"{self.dsn}: {self.circuito.descripcion()}")
+        with self.lock:
+            if self.conn is None:
+                self.conn = conectar_odbc(self.dsn)
+                if self.conn is None:
+                    self.circuito.fallo("no se pudo conectar")
+                    raise FuenteNoDisponible(f"{self.dsn}: no se pudo conectar")
+            inicio = time.strftime("%Y-%m-%d %H:%M:%S")
+            t0 = time.perf_counter()
+            try:
+                cur = self.cursores.get(sql)
+                if cur is None:
+                    cur = self.cursores[sql] = self.conn.cursor()
+                cur.execute(sql, params)
+                filas = cur.fetchall()
+                columnas = [d[0].upper() for d in cur.description]
+            except Exception as e:
+                # Conexión rota o sentencia inválida: se descarta todo y se reconecta en la próxima llamada
+                self.cerrar()
+                self.circuito.fallo(e)
+                raise
+            self.circuito.exito()
+            segundos = time.perf_counter() - t0
+            lenta = self.registro is not None and segundos >= self.registro.umbral
+            plan = self.capturar_plan(sql, params) if lenta else None
+        # coerce_float=True como pd.read_sql: los NUMERIC de Firebird llegan como Decimal
+        df = pd.DataFrame.from_records([tuple(f) for f in filas], columns=columnas, coerce_float=True)
+        if self.registro is not None:
+            self.registro.registrar({
+                'inicio': inicio, 'sesion': sesion, 'dsn': self.dsn, 'consulta': nombre or sql[:60], 'segundos': round(segundos, 4),
+                'filas': len(df), 'columnas': len(columnas), 'bytes': int(df.memory_usage(deep=True).sum()),
+                'params': [str(p) for p in params], 'lenta': lenta, 'sql': sql if lenta else None, 'plan': plan,
+            })
+        return df
+
+    def capturar_plan(self, sql, params):
+        """Plan de ejecución de una sentencia ya preparada en esta conexión (llamar con el lock tomado)."""
+        cur = self.conn.cursor()
         try:
-            shutil.copy2(PATH_EXCEL_ORIGEN, tmp.name)
-            path_lectura = tmp.name
-        except PermissionError:
-            path_lectura = PATH_EXCEL_ORIGEN
+            if isinstance(self.conn, sqlite3.Connection):
+                cur.execute("EXPLAIN QUERY PLAN " + sql, params)
+                return "\n".join(str(f[-1]) for f in cur.fetchall())
+            # Firebird (3+) expone el plan de las sentencias preparadas de la conexión en MON$STATEMENTS;
+            # el cursor de la consulta sigue abierto, así que la sentencia está en la tabla de monitoreo.
+            cur.execute("SELECT MON$SQL_TEXT, MON$EXPLAINED_PLAN FROM MON$STATEMENTS WHERE MON$ATTACHMENT_ID = CURRENT_CONNECTION")
+            for texto, plan in cur.fetchall():
+                if texto is not None and str(texto).strip() == sql.strip():
+                    return str(plan)
+            return "(plan no encontrado en MON$STATEMENTS)"
+        except Exception as e:
+            return f"(plan no disponible: {e})"
+        finally:
+            cur.close()
+
+    def cerrar(self):
+        for cur in self.cursores.values():
+            try: cur.close()
+            except: pass
+        self.cursores.clear()
+        if self.conn is not None:
+            try: self.conn.close()
+            except: pass
+        self.conn = None
+
+class PoolConexiones:
+    """Una ConexionPreparada por DSN, compartida por todas las sesiones del proceso."""
+
+    def __init__(self, registro=None):
+        self.registro = registro
+        self.conexiones = {}
+        self.lock = threading.Lock()
+
+    def obtener(self, dsn):
+        with self.lock:
+            if dsn not in self.conexiones:
+                self.conexiones[dsn] = ConexionPreparada(dsn, self.registro)
+            return self.conexiones[dsn]
+
+    def cerrar(self):
+        with self.lock:
+            for c in self.conexiones.values(): c.cerrar()
+            self.conexiones.clear()
+
+class CacheResultados:
+    """LRU de resultados por valores de parámetros, acotado en entradas, bytes y TTL.
+
+    El tamaño de cada entrada es la memoria real de sus DataFrames; al superar el
+    límite se desalojan las entradas menos usadas recientemente.
+    """
+
+    def __init__(self, max_bytes=CACHE_SQL_MAX_BYTES, max_entradas=CACHE_SQL_MAX_ENTRADAS, ttl=TTL_SQL):
+        self.max_bytes = max_bytes
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.entradas = OrderedDict()  # clave -> (vence, bytes, valor)
+        self.bytes_totales = 0
+        self.en_curso = {}  # clave -> Future del cálculo en vuelo
+        self.fijas = {}     # clave -> valor que no vence ni se desaloja (ver guardar)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def medir(valor):
+        if isinstance(valor, pd.DataFrame): return int(valor.memory_usage(deep=True).sum())
+        if isinstance(valor, dict): valor = valor.values()
+        if isinstance(valor, (tuple, list, type({}.values()))): return sum(CacheResultados.medir(v) for v in valor)
+        return 0
+
+    def obtener(self, clave):
+        with self.lock:
+            if clave in self.fijas: return self.fijas[clave]
+            entrada = self.entradas.get(clave)
+            if entrada is None: return None
+            instante, tamano, valor = entrada
+            if time.monotonic() > instante:
+                del self.entradas[clave]
+                self.bytes_totales -= tamano
+                return None
+            self.entradas.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor, ttl=None, fija=False):
+        """fija: la entrada queda fuera del LRU, sin vencer ni desalojarse (para pocas claves conocidas)."""
+        tamano = self.medir(valor)
+        with self.lock:
+            anterior = self.entradas.pop(clave, None)
+            if anterior is not None: self.bytes_totales -= anterior[1]
+            if fija:
+                self.fijas[clave] = valor
+                return
+            if tamano > self.max_bytes: return
+            self.entradas[clave] = (time.monotonic() + (self.ttl if ttl is None else ttl), tamano, valor)
+            self.bytes_totales += tamano
+            while self.entradas and (self.bytes_totales > self.max_bytes or len(self.entradas) > self.max_entradas):
+                _, (_, t, _) = self.entradas.popitem(last=False)
+                self.bytes_totales -= t
+
+    def reservar(self, clave):
+        """(futuro, lider) para una clave ausente: el primero en pedirla es el líder y la calcula, los demás esperan su futuro."""
+        with self.lock:
+            futuro = self.en_curso.get(clave)
+            if futuro is not None: return futuro, False
+            futuro = self.en_curso[clave] = Future()
+            return futuro, True
+
+    def liberar(self, clave, futuro, valor):
+        """Lo llama el líder al terminar; valor None (falló o se interrumpió) hace que los que esperaban reintenten."""
+        with self.lock:
+            if self.en_curso.get(clave) is futuro: del self.en_curso[clave]
+        futuro.set_result(valor)
+
+    def limpiar(self):
+        with self.lock:
+            self.entradas.clear()
+            self.fijas.clear()
+            self.bytes_totales = 0
+
+@st.cache_resource
+def get_registro_consultas():
+    return RegistroConsultas()
+
+@st.cache_resource
+def get_pool_conexiones():
+    return PoolConexiones(get_registro_consultas())
+
+@st.cache_resource
+def get_cache_resultados():
+    return CacheResultados()
+
+@st.cache_resource
+def get_ultimos_buenos():
+    # Último resultado correcto de cada fuente, sin vencimiento: se sirve cuando el DSN no responde.
+    # El de los parámetros por defecto queda fijo: probar otras fechas no lo desaloja.
+    return CacheResultados(max_entradas=4 * len(FUENTES), ttl=float('inf'))
+
+@st.cache_resource
+def get_cache_consolidados():
+    # Consolidado por parámetros, atado a la identidad de sus entradas: mismas entradas, mismo objeto para todas las sesiones
+    return CacheResultados(max_entradas=CACHE_SQL_MAX_ENTRADAS, ttl=TTL_SQL)
+
+@st.cache_resource
+def get_cache_vistas():
+    return CacheResultados(max_entradas=4, ttl=TTL_SQL)
 
+@st.cache_resource
+def get_cache_detalle_op():
+    return CacheResultados(max_bytes=DETALLE_OP_MAX_BYTES, max_entradas=DETALLE_OP_MAX_ARTICULOS, ttl=TTL_DETALLE_OP)
+
+def id_sesion():
+    """Identificador de la sesión de navegador actual; queda en el log de consultas que dispara."""
     try:
-        wb = openpyxl.load_workbook(path_lectura, data_only=True, read_only=False)
-        res_data = None
-        for sheet in wb.worksheets:
-            if "PROYECTADO_2" in sheet.tables:
-                tbl = sheet.tables["PROYECTADO_2"]
-                rango = tbl.ref
-                # CORRECCIÓN PYLANCE: Extracción limpia de valores
-                data = []
-                for row in sheet[rango]:
-                    data.append([cell.value for cell in row]) # type: ignore
-                
-                if len(data) > 1:
-                    res_data = pd.DataFrame(data[1:], columns=data[0])
-                break
-        wb.close()
-        
-        try: os.remove(path_lectura)
-        except: pass
+        if 'id_sesion' not in st.session_state: st.session_state['id_sesion'] = uuid.uuid4().hex[:8]
+        return st.session_state['id_sesion']
+    except Exception:
+        return None  # fuera de una sesión de Streamlit (scripts, pruebas)
 
-        if res_data is None: return pd.DataFrame()
+def preparar_consulta(nombre, fuente, params):
+    """Texto SQL y valores ligados de una consulta del registro; None si no hay tipos de comprobante."""
+    marcadores = ", ".join("?" * len(params.tipos_comprobante))
+    if nombre in ('q_ventas', 'q_canal_facturas') and not params.tipos_comprobante: return None
+    if nombre == 'q_art': return Q_ART, ()
+    if nombre == 'q_ventas': return Q_VENTAS.format(tipos=marcadores), (params.fecha_ventas, *params.tipos_comprobante)
+    if nombre == 'q_pedidos': return Q_PEDIDOS, ()
+    if nombre == 'q_op': return Q_OP, ()
+    if nombre == 'q_canal': return Q_CANAL, (params.fecha_canal(fuente),)
+    if nombre == 'q_canal_facturas': return Q_CANAL_FACTURAS.format(tipos=marcadores), (params.fecha_canal(fuente), *params.tipos_comprobante)
+    raise ValueError(f"Consulta desconocida: {nombre}")
 
-        df = res_data
-        df.columns = df.columns.astype(str).str.strip()
-        meses = ['MES2', 'MES3', 'MES4']
-        for m in meses:
-            if m in df.columns:
-                df[m] = pd.to_numeric(df[m], errors='coerce').fillna(0)
-            else:
-                df[m] = 0
-        
-        df['PEDIDO_PROYECTADO'] = df[meses].sum(axis=1)
-        col_cod = 'Codigo' if 'Codigo' in df.columns else df.columns[0]
-        col_des = 'Descripción' if 'Descripción' in df.columns else (df.columns[1] if len(df.columns) > 1 else 'Descripción')
-        
-        df = df[[col_cod, col_des, 'PEDIDO_PROYECTADO']].rename(columns={col_cod: 'CODIGOPARTICULAR', col_des: 'DESCRIPCION'})
-        df['CODIGOPARTICULAR'] = df['CODIGOPARTICULAR'].astype(str).str.strip().str.upper()
-        return df
-    except Exception as e:
-        st.error(f"Error procesando Excel: {e}")
-        return pd.DataFrame()
+def clave_fuente(fuente, params):
+    """Clave del último dato bueno de una fuente: solo los valores que ligan sus propias consultas,
+    así cambiar la fecha de ventas no deja a una fuente canal sin último dato bueno."""
+    consultas = [preparar_consulta(nombre, fuente, params) for nombre in fuente['consultas']]
+    return (fuente['nombre'], *(None if c is None else c[1] for c in consultas))
+
+def ultimo_bueno(ultimos, fuente, params, error):
+    """(resultados, estado) con el último dato bueno de la fuente, o (None, estado) si nunca hubo."""
+    previo = ultimos.obtener(clave_fuente(fuente, params))
+    instante, res = previo if previo is not None else (None, None)
+    return res, {'fresco': False, 'instante': instante, 'error': str(error)}
 
-@st.cache_data(ttl=600, show_spinner="Consultando Base de Datos...")
-def get_datos_sql():
-    conn_brogas = conectar_odbc("BROGAS")
-    conn_ml = conectar_odbc("BROGASML")
-    if not conn_brogas: return None, None, None, None, None
+def consultar_fuente(pool, ultimos, fuente, params, sesion=None):
+    """Ejecuta en orden las consultas de una fuente sobre su conexión. Devuelve (resultados, estado).
 
+    Si el DSN falla o su circuito está abierto, devuelve el último resultado bueno de esa fuente.
+    """
+    conn = pool.obtener(fuente['dsn'])
+    res = {}
     try:
-        # CORRECCIÓN PYLANCE: se añade # type: ignore para las conexiones de pyodbc en read_sql
-        q_art = "SELECT A.CODIGOPARTICULAR, A.DESCRIPCION, SUM(C.STOCKACTUAL) as STOCK FROM ARTICULOS A LEFT JOIN CASILLEROS C ON A.CODIGOARTICULO = C.CODIGOARTICULO LEFT JOIN DEPOSITOS D ON C.CODIGODEPOSITO = D.CODIGODEPOSITO WHERE D.DESCRIPCION NOT IN ('COMPRAS NC','ALUCOLOR','ECOMMERCE_FULL_BRO','ECOMMERCE_FULL_1','CONTROL DE CALIDAD', 'SALDOS','ECOMMERCE_FACTURACIÓN', 'ECOMMERCE_STOCK', 'SCRAP', 'SERVICIO TECNICO', 'SHOWROOM', 'M. NO CONFORMES') GROUP BY A.CODIGOPARTICULAR, A.DESCRIPCION"
-        df_art = pd.read_sql(q_art, conn_brogas) # type: ignore
+        for nombre in fuente['consultas']:
+            consulta = preparar_consulta(nombre, fuente, params)
+            res[nombre] = None if consulta is None else conn.consultar(*consulta, nombre=nombre, sesion=sesion)
+    except Exception as e:
+        return ultimo_bueno(ultimos, fuente, params, e)
+    instante = time.time()
+    clave = clave_fuente(fuente, params)
+    ultimos.guardar(clave, (instante, res), fija=clave == clave_fuente(fuente, parametros_por_defecto()))
+    return res, {'fresco': True, 'instante': instante, 'error': None}
 
-        q_ventas = f"SELECT CODIGOPARTICULAR, SUM(CANTIDAD - CANTIDADREMITIDA) as PENDIENTES_VENTAS FROM CUERPOCOMPROBANTES WHERE FECHAMODIFICACION > '{FECHA_FILTRO_BROGAS}' AND TIPOCOMPROBANTE IN ('FA', 'FB', 'FCA', 'FE') AND (CANTIDAD - CANTIDADREMITIDA) > 0 GROUP BY CODIGOPARTICULAR"
-        df_ventas = pd.read_sql(q_ventas, conn_brogas) # type: ignore
+def unir_pendientes_canal(resultados):
+    """Una columna PENDIENTE_<nombre> por fuente canal, unidas por CODIGOPARTICULAR."""
+    df_canales = None
+    for fuente, col in zip(FUENTES_CANAL, COLUMNAS_CANAL):
+        partes = [d for d in (resultados.get(fuente['nombre']) or {}).values() if d is not None and not d.empty]
+        if not partes: continue
+        df = pd.concat(partes).groupby('CODIGOPARTICULAR', as_index=False)['PENDIENTE'].sum().rename(columns={'PENDIENTE': col})
+        df_canales = df if df_canales is None else df_canales.merge(df, on='CODIGOPARTICULAR', how='outer')
+    return df_canales if df_canales is not None else pd.DataFrame()
 
-        q_pedidos = "SELECT CP.CODIGOPARTICULAR, SUM(CP.CANTIDAD) as PEDIDOS_NUEVOS FROM CUERPOPEDIDOS CP INNER JOIN CABEZAPEDIDOS CB ON CP.NUMEROCOMPROBANTE = CB.NUMEROCOMPROBANTE AND CP.TIPOCOMPROBANTE = CB.TIPOCOMPROBANTE INNER JOIN DEPOSITOS D ON CP.CODIGODEPOSITO = D.CODIGODEPOSITO WHERE CB.ANULADA = 0 AND CP.CANTIDADCANCELADA = 0 AND CP.CANTIDADREMITIDA = 0 AND CP.CANTIDADPREPARADA = 0 AND D.DESCRIPCION IN ('EXPEDICION', 'FIZBAY') GROUP BY CP.CODIGOPARTICULAR"
-        df_pedidos = pd.read_sql(q_pedidos, conn_brogas) # type: ignore
+def get_datos_sql(params=ParametrosConsulta()):
+    """Devuelve (art, ventas, pedidos, op, canales, estado). Los DataFrames se comparten entre sesiones: no mutarlos.
 
-        q_op = "SELECT A.CODIGOPARTICULAR, SUM(CP.CANTIDAD) as CANTIDAD_TOTAL_OP, SUM(CP.CANTIDAD - COALESCE(ENTREGAS.TOTAL_ENTREGADO, 0)) as EN_PRODUCCION FROM PRODCABEZAORDEN H INNER JOIN PRODCUERPOORDEN CP ON H.CODIGOORDEN = CP.CODIGOORDEN INNER JOIN ARTICULOS A ON CP.CODIGOARTICULO = A.CODIGOARTICULO LEFT JOIN (SELECT CODIGOORDEN, CODIGOARTICULO, SUM(CANTIDAD) as TOTAL_ENTREGADO FROM PRODDETALLEFINALIZACIONORDEN GROUP BY CODIGOORDEN, CODIGOARTICULO) ENTREGAS ON CP.CODIGOORDEN = ENTREGAS.CODIGOORDEN AND CP.CODIGOARTICULO = ENTREGAS.CODIGOARTICULO LEFT JOIN ESTADOSORDENPRODUCCION E ON H.CODIGOESTADOOP = E.CODIGOESTADOOP WHERE H.ANULADA = 0 AND COALESCE(E.DESCRIPCION, '') <> 'TERMINADO' AND (CP.CANTIDAD - COALESCE(ENTREGAS.TOTAL_ENTREGADO, 0)) > 0 GROUP BY A.CODIGOPARTICULAR"
-        df_op = pd.read_sql(q_op, conn_brogas) # type: ignore
+    Todas las fuentes del registro se consultan en paralelo, así que el tiempo total es el de la más lenta,
+    con tope LATENCIA_MAX_FUENTES. estado indica por fuente si el dato es fresco o el último bueno y de cuándo.
+    """
+    cache = get_cache_resultados()
+    # Clave como tupla simple: la clase ParametrosConsulta se redefine en cada rerun y dos
+    # instancias de ejecuciones distintas nunca son iguales entre sí.
+    clave = astuple(params)
+    res = cache.obtener(clave)
+    if res is not None: return res
+
+    # Single-flight: con varias sesiones frías a la vez, solo la primera consulta las fuentes y el resto espera su resultado
+    futuro, lider = cache.reservar(clave)
+    if not lider:
+        with st.spinner("Consultando Base de Datos (consulta en curso desde otra sesión)..."):
+            res = futuro.result()
+        return res if res is not None else get_datos_sql(params)  # el líder falló o se interrumpió: reintentar
+    res = None
+    try:
+        res = cache.obtener(clave)  # otro líder pudo terminar entre el fallo de caché y la reserva
+        if res is None: res = consultar_fuentes(params, cache, clave)
     finally:
-        conn_brogas.close()
+        cache.liberar(clave, futuro, res)
+    return res
 
-    df_ml = pd.DataFrame()
-    if conn_ml:
-        try:
-            q_ml = f"SELECT CODIGOPARTICULAR, SUM(CANTIDAD - CANTIDADREMITIDA) as PENDIENTE_ML FROM CUERPOCOMPROBANTES WHERE FECHAMODIFICACION > '{FECHA_FILTRO_ML}' GROUP BY CODIGOPARTICULAR"
-            df_ml = pd.read_sql(q_ml, conn_ml) # type: ignore
-        except: pass
-        finally: conn_ml.close()
+def consultar_fuentes(params, cache, clave):
+    """Consulta todas las fuentes para get_datos_sql y guarda el resultado en la caché bajo clave."""
+    with st.spinner("Consultando Base de Datos..."):
+        pool = get_pool_conexiones()
+        ultimos = get_ultimos_buenos()
+        ctx = get_script_run_ctx()
+        ex = ThreadPoolExecutor(max_workers=len(FUENTES), thread_name_prefix="fuente",
+                                initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx))
+        futuros = {fu['nombre']: ex.submit(consultar_fuente, pool, ultimos, fu, params, id_sesion()) for fu in FUENTES}
+        limite = time.monotonic() + LATENCIA_MAX_FUENTES
+        resultados, estado = {}, {}
+        for fu in FUENTES:
+            try:
+                res_fuente, est = futuros[fu['nombre']].result(timeout=max(limite - time.monotonic(), 0))
+            except FuturoTimeout:
+                # La consulta sigue en su hilo y, si termina bien, queda como último dato bueno para el próximo refresco
+                res_fuente, est = ultimo_bueno(ultimos, fu, params, f"sin respuesta en {LATENCIA_MAX_FUENTES} s")
+            resultados[fu['nombre']] = res_fuente
+            estado[fu['nombre']] = {**est, 'dsn': fu['dsn'], 'rol': fu['rol']}
+        ex.shutdown(wait=False)
 
-    return df_art, df_ventas, df_pedidos, df_op, df_ml
+    res_principal = resultados[FUENTE_PRINCIPAL['nombre']]
+    if res_principal is None: return None, None, None, None, None, estado
+    df_ventas = res_principal.get('q_ventas')
+    if df_ventas is None: df_ventas = pd.DataFrame(columns=['CODIGOPARTICULAR', 'PENDIENTES_VENTAS'])
+
+    res = (res_principal.get('q_art'), df_ventas, res_principal.get('q_pedidos'), res_principal.get('q_op'), unir_pendientes_canal(resultados), estado)
+    cache.guardar(clave, res, ttl=None if all(e['fresco'] for e in estado.values()) else TTL_SQL_DEGRADADO)
+    return res
+
+def get_detalle_op(codigo):
+    """Órdenes abiertas de un artículo (drill-down). Se consulta solo a pedido y queda en una caché por artículo."""
+    cache = get_cache_detalle_op()
+    df = cache.obtener(codigo)
+    if df is not None: return df
+    try:
+        conn = get_pool_conexiones().obtener(FUENTE_PRINCIPAL['dsn'])
+        df = conn.consultar(Q_OP_DETALLE, (codigo, codigo), nombre="q_op_detalle", sesion=id_sesion())
+    except FuenteNoDisponible as e:
+        st.warning(f"⏳ Detalle no disponible: {e}")
+        return pd.DataFrame()
+    except Exception as e:  # la falla no se cachea: el próximo clic vuelve a consultar
+        st.warning(f"⚠️ No se pudo consultar el detalle de {codigo}: {e}")
+        return pd.DataFrame()
+    cache.guardar(codigo, df)
+    return df
 
 # --- 3. LÓGICA DE CONSOLIDACIÓN ---
 
-def procesar_datos_consolidado():
+def procesar_datos_consolidado(params=ParametrosConsulta()):
+    """Devuelve (consolidado, maestro de stock, producción, estado de las fuentes).
+
+    Mientras la proyección y los datos SQL sean los mismos objetos (cachés compartidas), devuelve
+    el mismo consolidado a todas las sesiones sin recalcularlo: es una versión de datos, no mutarla.
+    """
     df_proy = get_proyectado_optimizado()
-    if df_proy.empty: return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+    if df_proy.empty: return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), {}
 
-    df_art, df_ventas, df_pedidos, df_op, df_ml = get_datos_sql()
-    if df_art is None: return df_proy, pd.DataFrame(), pd.DataFrame()
+    # Las columnas ya vienen en mayúsculas desde ConexionPreparada
+    datos = get_datos_sql(params)
+    df_art, df_ventas, df_pedidos, df_op, df_canales, estado = datos
+    if df_art is None: return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), estado
 
-    for d in [df_art, df_ventas, df_pedidos, df_op, df_ml]:
-        if d is not None and not d.empty: d.columns = d.columns.str.upper()
+    cache = get_cache_consolidados()
+    previo = cache.obtener(astuple(params))
+    if previo is not None and previo[0] is df_proy and previo[1] is datos: return previo[2]
 
     final = df_proy.merge(df_art, on='CODIGOPARTICULAR', how='left', suffixes=('_EXCEL', '_SQL'))
     final['DESCRIPCION'] = final['DESCRIPCION_SQL'].fillna(final['DESCRIPCION_EXCEL'])
@@ -138,49 +803,357 @@ def procesar_datos_consolidado():
 
     if df_ventas is not None: final = final.merge(df_ventas, on='CODIGOPARTICULAR', how='left')
     if df_pedidos is not None: final = final.merge(df_pedidos, on='CODIGOPARTICULAR', how='left')
-    if df_ml is not None and not df_ml.empty: final = final.merge(df_ml, on='CODIGOPARTICULAR', how='left')
+    if df_canales is not None and not df_canales.empty: final = final.merge(df_canales, on='CODIGOPARTICULAR', how='left')
     if df_op is not None: final = final.merge(df_op, on='CODIGOPARTICULAR', how='left')
 
+    for c in COLUMNAS_CANAL:
+        if c not in final.columns: final[c] = 0
+
     final = final.fillna(0)
-    final['PENDIENTE_TOTAL'] = final.get('PENDIENTES_VENTAS', 0) + final.get('PEDIDOS_NUEVOS', 0) + final.get('PENDIENTE_ML', 0)
+    final['PENDIENTE_TOTAL'] = final.get('PENDIENTES_VENTAS', 0) + final.get('PEDIDOS_NUEVOS', 0) + final[COLUMNAS_CANAL].sum(axis=1)
     final['STOCK_NETO'] = final['STOCK'] - final['PENDIENTE_TOTAL']
     final['COBERTURA_MESES'] = np.where(final['PEDIDO_PROYECTADO'] > 0, (final['STOCK_NETO'] / final['PEDIDO_PROYECTADO']) * 3, 999)
     final.loc[(final['STOCK_NETO'] <= 0), 'COBERTURA_MESES'] = 0
 
-    cols_order = ['CODIGOPARTICULAR', 'DESCRIPCION', 'PEDIDO_PROYECTADO', 'STOCK', 'PENDIENTE_TOTAL', 'STOCK_NETO', 'COBERTURA_MESES', 'EN_PRODUCCION']
+    cols_order = ['CODIGOPARTICULAR', 'DESCRIPCION', 'PEDIDO_PROYECTADO', 'STOCK', 'PENDIENTE_TOTAL', *COLUMNAS_CANAL, 'STOCK_NETO', 'COBERTURA_MESES', 'EN_PRODUCCION']
     for c in cols_order:
         if c not in final.columns: final[c] = 0
 
-    return final[cols_order], df_art, df_op
+    res = (final[cols_order], df_art, df_op, estado)
+    cache.guardar(astuple(params), (df_proy, datos, res))
+    if astuple(params) == astuple(parametros_por_defecto()): registrar_version(res[0])
+    return res
+
+class VistasResultado:
+    """Tablas de las pestañas para una versión del consolidado, armadas una vez y compartidas por
+    todas las sesiones. Vienen ya ordenadas por CODIGOPARTICULAR (el orden que muestra la interfaz);
+    las sesiones las usan tal cual o derivan vistas sin copia (Copy-on-Write). No mutarlas.
+    """
+
+    def __init__(self, final, df_art, df_op):
+        self.final = final
+        codigos = final['CODIGOPARTICULAR'].unique()
+        orden = final['CODIGOPARTICULAR'].argsort(kind='stable').to_numpy()
+        if df_op is not None and not df_op.empty:
+            saldo = final['CODIGOPARTICULAR'].map(df_op.drop_duplicates('CODIGOPARTICULAR').set_index('CODIGOPARTICULAR')['EN_PRODUCCION'])
+        else:
+            saldo = pd.Series(0, index=final.index)
+        # Como el merge con df_op que hacía la pestaña, pero por posición: mismo número de filas y sin copiar el resto
+        self.cobertura = final.assign(**{'SALDO PENDIENTE': saldo.fillna(0)}).take(orden).reset_index(drop=True)
+
+        self.stock = None
+        if df_art is not None and not df_art.empty:
+            self.stock = df_art[df_art['CODIGOPARTICULAR'].isin(codigos)].sort_values('CODIGOPARTICULAR', kind='stable').reset_index(drop=True)
 
-# --- 4. INTERFAZ VISUAL ---
+        self.produccion = None
+        if df_op is not None and not df_op.empty:
+            df = df_op[df_op['CODIGOPARTICULAR'].isin(codigos)].merge(final[['CODIGOPARTICULAR', 'DESCRIPCION']].drop_duplicates(), on='CODIGOPARTICULAR', how='left')
+            df = df.rename(columns={'CANTIDAD_TOTAL_OP': 'CANT. TOTAL OP', 'EN_PRODUCCION': 'SALDO PENDIENTE'})
+            cols_orden = ['CODIGOPARTICULAR', 'DESCRIPCION', 'CANT. TOTAL OP', 'SALDO PENDIENTE']
+            self.produccion = df[[c for c in cols_orden if c in df.columns]].sort_values('CODIGOPARTICULAR', kind='stable').reset_index(drop=True)
+
+        self._csv = None
+        self.lock = threading.Lock()
+
+    def csv_cobertura(self):
+        with self.lock:
+            if self._csv is None: self._csv = self.cobertura.to_csv(index=False).encode('utf-8')
+            return self._csv
+
+def get_vistas(final, df_art, df_op):
+    """VistasResultado de este consolidado; se arma solo la primera vez que alguna sesión lo pide."""
+    cache = get_cache_vistas()
+    previo = cache.obtener(id(final))
+    if previo is not None and previo[0] is final: return previo[1]
+    vistas = VistasResultado(final, df_art, df_op)
+    cache.guardar(id(final), (final, vistas))
+    return vistas
+
+# --- 4. HISTORIAL Y CAMBIOS ---
+
+COLUMNAS_DIFF = ['PEDIDO_PROYECTADO', 'STOCK', 'PENDIENTE_TOTAL', 'STOCK_NETO', 'COBERTURA_MESES', 'EN_PRODUCCION']
+
+def banda_cobertura(cobertura):
+    """Índice de banda (0 crítica … 3 exceso) para cada valor de COBERTURA_MESES, vectorizado."""
+    c = np.asarray(cobertura, dtype=float)
+    return np.select([c <= UMBRAL_CRITICO, c <= UMBRAL_BAJO, c < COBERTURA_EXCESO], [0, 1, 2], 3)
+
+def normalizar_snapshot(df):
+    """Acepta el consolidado, un snapshot guardado o un export CSV de la app (con índice y DESCRIPCIÓN)."""
+    df = df.drop(columns=[c for c in df.columns if str(c).startswith('Unnamed') or str(c).strip() == ''])
+    df = df.rename(columns={'DESCRIPCIÓN': 'DESCRIPCION', 'CANTIDAD EN PROD': 'EN_PRODUCCION'})
+    df['CODIGOPARTICULAR'] = df['CODIGOPARTICULAR'].astype(str).str.strip().str.upper()
+    return df.drop_duplicates('CODIGOPARTICULAR')
+
+def comparar_snapshots(anterior, actual, top=TOP_CAMBIOS):
+    """Diferencias entre dos consolidados con un solo join por CODIGOPARTICULAR.
+
+    Devuelve altas, bajas, cambios de banda de cobertura y las mayores variaciones
+    de STOCK_NETO y PENDIENTE_TOTAL. Todo vectorizado: escala a cientos de miles de artículos.
+    """
+    anterior, actual = normalizar_snapshot(anterior), normalizar_snapshot(actual)
+    cols = [c for c in COLUMNAS_DIFF if c in anterior.columns and c in actual.columns]
+    m = anterior[['CODIGOPARTICULAR', 'DESCRIPCION', *cols]].merge(
+        actual[['CODIGOPARTICULAR', 'DESCRIPCION', *cols]], on='CODIGOPARTICULAR', how='outer', suffixes=('_ANT', '_ACT'), indicator=True)
+
+    def lado(mask, sufijo):
+        df = m.loc[mask, ['CODIGOPARTICULAR', 'DESCRIPCION' + sufijo, *[c + sufijo for c in cols]]]
+        return df.rename(columns=lambda c: c.removesuffix(sufijo)).sort_values('CODIGOPARTICULAR')
+
+    altas = lado(m['_merge'] == 'right_only', '_ACT')
+    bajas = lado(m['_merge'] == 'left_only', '_ANT')
+
+    ambos = m[m['_merge'] == 'both'].drop(columns='_merge')
+    ambos['DESCRIPCION'] = ambos['DESCRIPCION_ACT'].fillna(ambos['DESCRIPCION_ANT'])
+    for c in cols:
+        ambos[c + '_ANT'] = pd.to_numeric(ambos[c + '_ANT'], errors='coerce').fillna(0)
+        ambos[c + '_ACT'] = pd.to_numeric(ambos[c + '_ACT'], errors='coerce').fillna(0)
+        ambos['DELTA_' + c] = ambos[c + '_ACT'] - ambos[c + '_ANT']
+
+    cambios_banda = pd.DataFrame()
+    if 'COBERTURA_MESES' in cols:
+        b_ant = banda_cobertura(ambos['COBERTURA_MESES_ANT'])
+        b_act = banda_cobertura(ambos['COBERTURA_MESES_ACT'])
+        mask = b_ant != b_act
+        etiquetas = np.array(BANDAS_COBERTURA)
+        cambios_banda = ambos.loc[mask, ['CODIGOPARTICULAR', 'DESCRIPCION', 'COBERTURA_MESES_ANT', 'COBERTURA_MESES_ACT']].copy()
+        cambios_banda.insert(2, 'BANDA_ANT', etiquetas[b_ant[mask]])
+        cambios_banda.insert(3, 'BANDA_ACT', etiquetas[b_act[mask]])
+        cambios_banda['EMPEORA'] = b_act[mask] < b_ant[mask]
+        cambios_banda = cambios_banda.iloc[np.lexsort((cambios_banda['COBERTURA_MESES_ACT'].to_numpy(), b_act[mask]))]
+
+    deltas = {}
+    for c in ('STOCK_NETO', 'PENDIENTE_TOTAL'):
+        if c not in cols: continue
+        idx = ambos['DELTA_' + c].abs().nlargest(top).index
+        deltas[c] = ambos.loc[idx, ['CODIGOPARTICULAR', 'DESCRIPCION', c + '_ANT', c + '_ACT', 'DELTA_' + c]]
+        deltas[c] = deltas[c][deltas[c]['DELTA_' + c] != 0]
+
+    return {'altas': altas, 'bajas': bajas, 'cambios_banda': cambios_banda, 'deltas': deltas,
+            'comparados': len(ambos), 'con_cambios': int((ambos[['DELTA_' + c for c in cols]] != 0).any(axis=1).sum())}
+
+class HistorialSnapshots:
+    """Consolidados con los parámetros por defecto guardados como CSV en DIR_SNAPSHOTS, uno por
+    cada versión distinta de los datos (ver registrar_version)."""
+
+    def __init__(self, directorio=DIR_SNAPSHOTS, maximo=MAX_SNAPSHOTS):
+        self.directorio = directorio
+        self.maximo = maximo
+        self.lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+        existentes = self.listar()
+        self.ultimo_hash = existentes[0][1].rsplit('_', 1)[-1].removesuffix('.csv') if existentes else None
+
+    @staticmethod
+    def hash_df(df):
+        return hashlib.sha256(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()[:12]
+
+    def listar(self):
+        """[(etiqueta, path)] del más nuevo al más viejo."""
+        paths = sorted(glob.glob(os.path.join(self.directorio, "snapshot_*.csv")), reverse=True)
+        res = []
+        for p in paths:
+            _, fecha, hora, _ = os.path.basename(p).split('_')
+            res.append((f"{fecha[6:8]}/{fecha[4:6]}/{fecha[:4]} {hora[:2]}:{hora[2:4]}:{hora[4:6]}", p))
+        return res
+
+    def registrar(self, df):
+        """Guarda df si difiere del último snapshot. Devuelve el path del snapshot anterior si guardó, si no None."""
+        h = self.hash_df(df)
+        with self.lock:
+            if h == self.ultimo_hash: return None
+            existentes = self.listar()
+            path = os.path.join(self.directorio, f"snapshot_{time.strftime('%Y%m%d_%H%M%S')}_{h}.csv")
+            df.to_csv(path, index=False, encoding='utf-8')
+            self.ultimo_hash = h
+            for _, viejo in existentes[self.maximo - 1:]:
+                try: os.remove(viejo)
+                except OSError: pass
+            return existentes[0][1] if existentes else ""
+
+@st.cache_resource
+def get_historial_snapshots():
+    return HistorialSnapshots()
+
+def cargar_notificador(ref):
+    if not ref: return None
+    modulo, _, funcion = ref.partition(':')
+    return getattr(importlib.import_module(modulo), funcion or 'notificar')
+
+class EvaluadorAlertas:
+    """Detecta artículos que cruzan un umbral de cobertura entre una consolidación y la siguiente.
+
+    Guarda la banda de cada artículo de la corrida anterior y, por cada consolidación nueva,
+    emite solo los que entraron a ≤1 / ≤2 meses o salieron de ahí. Las alertas se agregan a
+    DIR_ALERTAS/outbox.jsonl y, si hay BROGAS_NOTIFICADOR, se pasan a esa función. Corre en un
+    hilo propio: la sesión que consolidó no espera la evaluación ni la notificación.
+    """
+
+    def __init__(self, base_inicial=None, directorio=DIR_ALERTAS, notificador=NOTIFICADOR_ALERTAS):
+        self.path_outbox = os.path.join(directorio, "outbox.jsonl")
+        self.base = None if base_inicial is None else self.bandas(base_inicial)  # por CODIGOPARTICULAR: COBERTURA_MESES, BANDA
+        self.ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="alertas")
+        self.logger = logging.getLogger("brogas.alertas")
+        self.error = None
+        self.recientes = deque(maxlen=50)
+        try:
+            os.makedirs(directorio, exist_ok=True)
+            if os.path.exists(self.path_outbox):
+                with open(self.path_outbox, encoding='utf-8') as f:
+                    self.recientes.extend(json.loads(linea) for linea in deque(f, maxlen=50))
+            self.notificador = cargar_notificador(notificador)
+        except Exception as e:
+            self.notificador = None
+            self.error = f"Alertas: {e}"
+
+    @staticmethod
+    def bandas(df):
+        b = df[['CODIGOPARTICULAR', 'COBERTURA_MESES']].drop_duplicates('CODIGOPARTICULAR').set_index('CODIGOPARTICULAR')
+        b['BANDA'] = banda_cobertura(b['COBERTURA_MESES'])
+        return b
+
+    def encolar(self, df):
+        self.ejecutor.submit(self.evaluar, df[['CODIGOPARTICULAR', 'DESCRIPCION', 'COBERTURA_MESES', 'STOCK_NETO']].copy())
+
+    def evaluar(self, df):
+        try:
+            actual = self.bandas(df)
+            if self.base is None:
+                self.base = actual  # primera corrida: solo se toma la línea base
+                return []
+            # Un artículo nuevo cuenta como si viniera de "OK": alerta solo si aparece ya en ≤2 meses
+            previa = self.base.reindex(actual.index)
+            b_ant = previa['BANDA'].fillna(2).astype(int).to_numpy()
+            b_act = actual['BANDA'].to_numpy()
+            mask = (b_ant != b_act) & ((b_ant <= 1) | (b_act <= 1))
+            self.base = actual
+            if not mask.any(): return []
+
+            fecha = time.strftime("%Y-%m-%d %H:%M:%S")
+            cambios = df.drop_duplicates('CODIGOPARTICULAR').set_index('CODIGOPARTICULAR').loc[actual.index[mask]]
+            cob_ant = previa['COBERTURA_MESES'].to_numpy()[mask]
+            alertas = [{
+                'fecha': fecha, 'tipo': 'ALERTA' if act < ant else 'RECUPERADO', 'codigo': codigo,
+                'descripcion': desc, 'banda_ant': BANDAS_COBERTURA[ant], 'banda_act': BANDAS_COBERTURA[act],
+                'cobertura_ant': None if pd.isna(c_ant) else round(float(c_ant), 2), 'cobertura_act': round(float(c_act), 2),
+                'stock_neto': float(neto),
+            } for codigo, desc, c_act, neto, ant, act, c_ant in zip(
+                cambios.index, cambios['DESCRIPCION'], cambios['COBERTURA_MESES'], cambios['STOCK_NETO'], b_ant[mask], b_act[mask], cob_ant)]
+            self.emitir(alertas)
+            return alertas
+        except Exception as e:
+            self.error = f"Alertas: {e}"
+            self.logger.exception("Error evaluando alertas de cobertura")
+            return []
+
+    def emitir(self, alertas):
+        with open(self.path_outbox, 'a', encoding='utf-8') as f:
+            for a in alertas: f.write(json.dumps(a, ensure_ascii=False) + "\n")
+        self.recientes.extend(alertas)
+        if self.notificador is not None:
+            try:
+                self.notificador(alertas)
+            except Exception as e:
+                self.error = f"Notificador {NOTIFICADOR_ALERTAS}: {e}"
+                self.logger.exception("Error en el notificador de alertas")
+
+@st.cache_resource
+def get_evaluador_alertas():
+    # Línea base: el último snapshot guardado, para no re-alertar todo el catálogo al reiniciar
+    existentes = get_historial_snapshots().listar()
+    return EvaluadorAlertas(cargar_snapshot(existentes[0][1]) if existentes else None)
+
+@st.cache_resource
+def get_cache_comparaciones():
+    # Resultado de comparar_snapshots por par (desde, hasta): los reruns de la pestaña no vuelven a comparar
+    return CacheResultados(max_entradas=8, ttl=TTL_SQL)
+
+def registrar_version(final):
+    """Snapshot y alertas de un consolidado nuevo con los parámetros por defecto.
+
+    Lo llama procesar_datos_consolidado una vez por objeto consolidado, no cada rerun. Otros
+    parámetros de la barra lateral no entran: alternarían con los por defecto en el historial
+    y las alertas irían y volverían.
+    """
+    historial = get_historial_snapshots()
+    evaluador = get_evaluador_alertas()  # antes de registrar: su línea base es la corrida anterior
+    if historial.registrar(final) is not None:
+        evaluador.encolar(final)
+
+@st.cache_data(max_entries=8)
+def cargar_snapshot(path):
+    # Los snapshots no se modifican una vez escritos: el path alcanza como clave
+    return normalizar_snapshot(pd.read_csv(path, encoding='utf-8-sig', dtype={'CODIGOPARTICULAR': str}, float_precision='round_trip'))
+
+# --- 5. INTERFAZ VISUAL ---
+
+def hace(instante):
+    seg = time.time() - instante
+    return f"{seg / 60:.0f} min" if seg < 3600 else f"{seg / 3600:.1f} h"
+
+def mostrar_estado_fuentes(estado):
+    """Avisa qué fuentes se sirvieron desde su último dato bueno (y de cuándo) o quedaron sin datos."""
+    for nombre, e in estado.items():
+        if e['fresco']: continue
+        if e['instante'] is not None:
+            st.warning(f"⏳ **{nombre}** ({e['dsn']}) no responde: sus cifras son de hace {hace(e['instante'])} "
+                       f"({time.strftime('%d/%m %H:%M', time.localtime(e['instante']))}). {e['error']}")
+        elif e['rol'] == 'canal':
+            st.error(f"❌ **{nombre}** ({e['dsn']}) sin datos: PENDIENTE_{nombre.upper()} va en 0 y el stock neto puede estar sobreestimado. {e['error']}")
+        else:
+            st.error(f"❌ **{nombre}** ({e['dsn']}) sin datos: {e['error']}")
 
 def main():
     st.title("🏭 Monitor de Stock e Inventario")
+    id_sesion()
+    if API_PUERTO: get_api()
     
     col1, col2 = st.columns([4, 1])
-    with col1: st.caption(f"**Origen:** {PATH_EXCEL_ORIGEN}")
+    espejo = get_espejo_proyectado()
+    with col1:
+        st.caption(f"**Origen:** {PATH_EXCEL_ORIGEN}"
+                   + (f" · leído {time.strftime('%d/%m %H:%M', time.localtime(espejo.actualizado))}" if espejo.actualizado else ""))
+        if espejo.error and espejo.df is not None:
+            st.warning(f"📄 Se muestra la última proyección buena (espejo local). {espejo.error}")
+        aviso = st.session_state.pop('aviso_espejo', None)
+        if aviso: st.warning(aviso)
     with col2:
         if st.button("🔄 Actualizar", type="primary"):
             st.cache_data.clear()
+            get_cache_resultados().limpiar()
+            get_cache_detalle_op().limpiar()
+            with st.spinner("Verificando Excel Proyectado..."):
+                if not espejo.pedir_verificacion():
+                    st.session_state['aviso_espejo'] = f"📄 El Excel no respondió en {ESPERA_ESPEJO} s: se muestra el espejo local y se sigue verificando en segundo plano."
             st.rerun()
 
+    with st.sidebar:
+        st.header("⚙️ Parámetros")
+        fecha_ventas = st.date_input("Pendientes de venta desde", value=ParametrosConsulta.fecha_ventas)
+        tipos = st.multiselect("Tipos de comprobante", TIPOS_COMPROBANTE, default=list(TIPOS_COMPROBANTE))
+        fechas_canal = tuple(
+            (fu['nombre'], st.date_input(f"Pendientes {fu['nombre']} desde", value=ParametrosConsulta().fecha_canal(fu), key=f"desde_{fu['nombre']}"))
+            for fu in FUENTES_CANAL)
+    params = ParametrosConsulta(fecha_ventas, tuple(tipos), fechas_canal)
+
     with st.spinner("Procesando..."):
-        df_final, df_stock_bruto, df_prod_bruto = procesar_datos_consolidado()
+        df_final, df_stock_bruto, df_prod_bruto, estado_fuentes = procesar_datos_consolidado(params)
 
+    mostrar_estado_fuentes(estado_fuentes)
     if df_final.empty:
         st.warning("⚠️ Sin datos.")
         return
+    if API_PUERTO and astuple(params) == astuple(parametros_por_defecto()):
+        get_publicacion_datos().publicar(df_final, df_stock_bruto, df_prod_bruto, estado_fuentes)
 
-    if df_prod_bruto is not None and not df_prod_bruto.empty:
-        df_prod_bruto.columns = df_prod_bruto.columns.str.upper()
+    historial = get_historial_snapshots()
+    evaluador = get_evaluador_alertas()
 
-    codigos_excel = df_final['CODIGOPARTICULAR'].unique()
-    tab1, tab2, tab3 = st.tabs(["🚀 Cobertura", "📦 Maestro Stock", "🛠️ Producción"])
+    vistas = get_vistas(df_final, df_stock_bruto, df_prod_bruto)
+    tab1, tab2, tab3, tab_cambios, tab4 = st.tabs(["🚀 Cobertura", "📦 Maestro Stock", "🛠️ Producción", "🔀 Cambios", "⏱️ Consultas"])
 
     def formatear_y_mostrar(df_in):
-        # ORDENAR ASCENDENTE Y QUITAR INDICE
-        df_in = df_in.sort_values('CODIGOPARTICULAR', ascending=True)
+        # Las vistas ya vienen ordenadas por CODIGOPARTICULAR; sin índice
         numeric_cols = df_in.select_dtypes(include=[np.number]).columns
         format_dict = {col: "{:,.0f}" for col in numeric_cols}
         st.dataframe(df_in.style.format(format_dict), use_container_width=True, hide_index=True)
@@ -188,56 +1161,463 @@ def main():
     with tab1:
         def style_cobertura(val):
             color = "#ffffff" 
-            if val <= 1.0: color = '#ff4b4b'
-            elif val <= 2.0: color = '#ffa421'
-            elif val > 2.0 and val < 100: color = '#21c354'
+            if val <= UMBRAL_CRITICO: color = '#ff4b4b'
+            elif val <= UMBRAL_BAJO: color = '#ffa421'
+            elif val > UMBRAL_BAJO and val < COBERTURA_EXCESO: color = '#21c354'
             return f'background-color: {color}; color: black'
 
-        if df_prod_bruto is not None and not df_prod_bruto.empty:
-            df_prod_temp = df_prod_bruto[['CODIGOPARTICULAR', 'EN_PRODUCCION']].copy()
-            df_prod_temp = df_prod_temp.rename(columns={'EN_PRODUCCION': 'SALDO PENDIENTE'})
-            df_mostrar = df_final.merge(df_prod_temp, on='CODIGOPARTICULAR', how='left')
-        else:
-            df_mostrar = df_final.copy()
-            df_mostrar['SALDO PENDIENTE'] = 0
+        df_mostrar = vistas.cobertura
 
-        df_mostrar['SALDO PENDIENTE'] = df_mostrar['SALDO PENDIENTE'].fillna(0)
-        
-        # ORDENAR ASCENDENTE
-        df_mostrar = df_mostrar.sort_values('CODIGOPARTICULAR', ascending=True)
+        # Las columnas de canales servidos desde su último dato bueno se marcan con ⏳
+        marcas = {col: f"{col} ⏳" for fu, col in zip(FUENTES_CANAL, COLUMNAS_CANAL)
+                  if not estado_fuentes.get(fu['nombre'], {}).get('fresco', True)}
+        df_vista = df_mostrar.rename(columns=marcas)
 
-        cols_numericas = ['STOCK', 'STOCK_NETO', 'PEDIDO_PROYECTADO', 'PENDIENTE_TOTAL', 'EN_PRODUCCION', 'SALDO PENDIENTE']
-        cols_a_formatear = [c for c in cols_numericas if c in df_mostrar.columns]
+        cols_numericas = ['STOCK', 'STOCK_NETO', 'PEDIDO_PROYECTADO', 'PENDIENTE_TOTAL', *[marcas.get(c, c) for c in COLUMNAS_CANAL], 'EN_PRODUCCION', 'SALDO PENDIENTE']
+        cols_a_formatear = [c for c in cols_numericas if c in df_vista.columns]
 
         st.dataframe(
-            df_mostrar.style.map(style_cobertura, subset=['COBERTURA_MESES', 'STOCK_NETO'])
+            df_vista.style.map(style_cobertura, subset=['COBERTURA_MESES', 'STOCK_NETO'])
             .format("{:,.0f}", subset=cols_a_formatear)
-            .format("{:,.2f}", subset=['COBERTURA_MESES'] if 'COBERTURA_MESES' in df_mostrar.columns else []),
+            .format("{:,.2f}", subset=['COBERTURA_MESES'] if 'COBERTURA_MESES' in df_vista.columns else []),
             use_container_width=True,
             height=700,
             hide_index=True # QUITA LA PRIMERA COLUMNA
         )
         
         fecha = time.strftime("%Y%m%d_%H%M")
-        st.download_button("📥 Descargar CSV", df_mostrar.to_csv(index=False).encode('utf-8'), f"Stock_{fecha}.csv", "text/csv")
+        st.download_button("📥 Descargar CSV", vistas.csv_cobertura(), f"Stock_{fecha}.csv", "text/csv")
 
     with tab2:
         st.subheader("Maestro Artículos (Filtrado por Excel)")
-        if df_stock_bruto is not None and not df_stock_bruto.empty:
-            df_stock_filtrado = df_stock_bruto[df_stock_bruto['CODIGOPARTICULAR'].isin(codigos_excel)].copy()
-            formatear_y_mostrar(df_stock_filtrado)
+        if vistas.stock is not None:
+            formatear_y_mostrar(vistas.stock)
 
     with tab3:
         st.subheader("Detalle de Producción (Filtrado por Excel)")
-        if df_prod_bruto is not None and not df_prod_bruto.empty:
-            df_prod_filtrado = df_prod_bruto[df_prod_bruto['CODIGOPARTICULAR'].isin(codigos_excel)].copy()
-            df_descripciones = df_final[['CODIGOPARTICULAR', 'DESCRIPCION']].drop_duplicates()
-            df_prod_filtrado = df_prod_filtrado.merge(df_descripciones, on='CODIGOPARTICULAR', how='left')
-            df_prod_filtrado = df_prod_filtrado.rename(columns={'CANTIDAD_TOTAL_OP': 'CANT. TOTAL OP', 'EN_PRODUCCION': 'SALDO PENDIENTE'})
-            
-            cols_orden = ['CODIGOPARTICULAR', 'DESCRIPCION', 'CANT. TOTAL OP', 'SALDO PENDIENTE']
-            df_prod_filtrado = df_prod_filtrado[[c for c in cols_orden if c in df_prod_filtrado.columns]]
+        if vistas.produccion is not None:
+            df_prod_filtrado = vistas.produccion
             formatear_y_mostrar(df_prod_filtrado)
 
+            st.markdown("##### 🔍 Órdenes de un artículo")
+            descripciones = dict(zip(df_prod_filtrado['CODIGOPARTICULAR'], df_prod_filtrado['DESCRIPCION']))
+            codigo = st.selectbox("Artículo", sorted(descripciones), index=None, placeholder="Elegí un artículo para ver sus órdenes...",
+                                  format_func=lambda c: f"{c} · {descripciones.get(c) or ''}")
+            if codigo:
+                df_ordenes = get_detalle_op(codigo)
+                if df_ordenes.empty:
+                    st.info("Sin órdenes abiertas con saldo para este artículo.")
+                else:
+                    st.dataframe(df_ordenes.style.format("{:,.0f}", subset=['CANTIDAD_OP', 'ENTREGADO', 'ENTREGAS_PARCIALES', 'SALDO_PENDIENTE']),
+                                 use_container_width=True, hide_index=True)
+                    st.caption(f"{len(df_ordenes)} órdenes · saldo pendiente {df_ordenes['SALDO_PENDIENTE'].sum():,.0f}")
+
+    with tab_cambios:
+        st.subheader("Cambios entre Corridas")
+        snapshots = dict(historial.listar())
+        etiquetas = ["Actual", *snapshots]
+        c1, c2, c3 = st.columns(3)
+        desde = c1.selectbox("Desde", etiquetas, index=min(2, len(etiquetas) - 1))
+        hasta = c2.selectbox("Hasta", etiquetas, index=0)
+        archivo = c3.file_uploader("…o desde un export CSV", type="csv")
+
+        cambios = None
+        try:
+            # Comparación cacheada por par: un snapshot no cambia una vez escrito, un export se identifica por
+            # su contenido y "Actual" queda atado al objeto consolidado compartido (otra versión, otra entrada)
+            actual = ('actual', id(df_final))
+            if archivo is not None:
+                desde, clave_desde = archivo.name, ('csv', hashlib.sha1(archivo.getvalue()).hexdigest())
+            else:
+                clave_desde = actual if desde == "Actual" else snapshots[desde]
+            clave_hasta = actual if hasta == "Actual" else snapshots[hasta]
+            ref = df_final if actual in (clave_desde, clave_hasta) else None
+            cache_cmp = get_cache_comparaciones()
+            previo = cache_cmp.obtener((clave_desde, clave_hasta))
+            if previo is not None and previo[0] is ref:
+                cambios = previo[1]
+            else:
+                if archivo is not None:
+                    df_desde = normalizar_snapshot(pd.read_csv(archivo, encoding='utf-8-sig', dtype={'CODIGOPARTICULAR': str}, float_precision='round_trip'))
+                else:
+                    df_desde = df_final if desde == "Actual" else cargar_snapshot(snapshots[desde])
+                df_hasta = df_final if hasta == "Actual" else cargar_snapshot(snapshots[hasta])
+                cambios = comparar_snapshots(df_desde, df_hasta)
+                cache_cmp.guardar((clave_desde, clave_hasta), (ref, cambios))
+        except (OSError, KeyError, ValueError) as e:
+            st.error(f"No se pudo leer el snapshot: {e}")
+
+        if cambios is not None:
+            st.caption(f"**{desde}** → **{hasta}** · {cambios['comparados']:,} artículos en ambos · {cambios['con_cambios']:,} con variaciones")
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("Altas", len(cambios['altas']))
+            m2.metric("Bajas", len(cambios['bajas']))
+            m3.metric("Cambios de banda", len(cambios['cambios_banda']))
+            m4.metric("Empeoran", int(cambios['cambios_banda']['EMPEORA'].sum()) if not cambios['cambios_banda'].empty else 0)
+
+            if not cambios['cambios_banda'].empty:
+                st.markdown("##### Cambios de banda de cobertura")
+                st.dataframe(cambios['cambios_banda'].style.format("{:,.2f}", subset=['COBERTURA_MESES_ANT', 'COBERTURA_MESES_ACT']),
+                             use_container_width=True, hide_index=True)
+            for col, df_delta in cambios['deltas'].items():
+                if df_delta.empty: continue
+                st.markdown(f"##### Mayores variaciones de {col}")
+                st.dataframe(df_delta.style.format("{:,.0f}", subset=df_delta.columns[2:]), use_container_width=True, hide_index=True)
+            for titulo, df_lado in (("Altas", cambios['altas']), ("Bajas", cambios['bajas'])):
+                if df_lado.empty: continue
+                with st.expander(f"{titulo} ({len(df_lado)})"):
+                    st.dataframe(df_lado, use_container_width=True, hide_index=True)
+
+        if evaluador.error: st.warning(evaluador.error)
+        with st.expander(f"🔔 Últimas alertas de cobertura ({len(evaluador.recientes)})"):
+            st.caption(f"Outbox: {evaluador.path_outbox}")
+            if evaluador.recientes:
+                st.dataframe(pd.DataFrame(list(evaluador.recientes)[::-1]), use_container_width=True, hide_index=True)
+
+    with tab4:
+        registro = get_registro_consultas()
+        st.subheader("Rendimiento de Consultas")
+        st.caption(f"Últimas {LOG_CONSULTAS_MAX} ejecuciones · umbral de consulta lenta: {registro.umbral:g} s · log: {DIR_LOGS}")
+        df_resumen = registro.resumen()
+        if df_resumen.empty:
+            st.info("Todavía no se ejecutaron consultas en este proceso (los datos vienen de la caché).")
+        else:
+            st.dataframe(df_resumen.style.format({'SEG_P50': "{:.3f}", 'SEG_MAX': "{:.3f}", 'BYTES': "{:,.0f}", 'FILAS': "{:,.0f}"}),
+                         use_container_width=True, hide_index=True)
+        for e in reversed(registro.lentas()[-10:]):
+            with st.expander(f"🐢 {e['inicio']} · {e['dsn']} · {e['consulta']} · {e['segundos']:.2f} s · {e['filas']:,} filas"):
+                st.code(e['sql'], language="sql")
+                st.text(e['plan'] or "(sin plan)")
+
+        st.markdown("##### Estado de las fuentes")
+        pool = get_pool_conexiones()
+        st.dataframe(pd.DataFrame([
+            {'DSN': dsn, 'CIRCUITO': c.circuito.estado(), 'FALLOS': c.circuito.fallos, 'DETALLE': c.circuito.descripcion() or ''}
+            for dsn, c in list(pool.conexiones.items())]), use_container_width=True, hide_index=True)
+
+# --- 6. API HTTP DE SOLO LECTURA ---
+
+class PublicacionDatos:
+    """Último consolidado con los parámetros por defecto, publicado para la API.
+
+    Lo publica cada rerun de la interfaz (y la propia API si está vencido, pasando por las
+    mismas cachés de get_datos_sql). La versión es un hash del contenido: sirve de ETag y
+    de clave para los cuerpos ya serializados, así el sondeo repetido no recalcula nada.
+    """
+
+    def __init__(self, max_respuestas=API_CACHE_RESPUESTAS):
+        self.version = None
+        self.instante = None
+        self.origen = None       # consolidado ya publicado: si llega el mismo objeto no se vuelve a hashear
+        self.fallido = None      # instante del último refresco que no pudo consolidar
+        self.tablas = {}
+        self.estado = {}
+        self.respuestas = OrderedDict()
+        self.max_respuestas = max_respuestas
+        self.lock = threading.Lock()
+        self.lock_refresco = threading.Lock()
+
+    def publicar(self, final, df_art, df_op, estado):
+        if final is self.origen:
+            with self.lock: self.instante, self.estado, self.fallido = time.time(), estado, None
+            return
+        codigos = final['CODIGOPARTICULAR'].unique()
+        tablas = {'cobertura': final.sort_values('CODIGOPARTICULAR').reset_index(drop=True)}
+        for nombre, df in (('stock', df_art), ('produccion', df_op)):
+            df = df if df is not None else pd.DataFrame(columns=['CODIGOPARTICULAR'])
+            tablas[nombre] = df[df['CODIGOPARTICULAR'].isin(codigos)].sort_values('CODIGOPARTICULAR').reset_index(drop=True)
+        h = hashlib.sha1()
+        for nombre, df in tablas.items():
+            h.update(nombre.encode())
+            h.update(",".join(df.columns).encode())
+            h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        version = h.hexdigest()[:16]
+        with self.lock:
+            self.instante = time.time()
+            self.estado = estado
+            self.origen = final
+            self.fallido = None
+            if version == self.version: return
+            self.version, self.tablas = version, tablas
+            self.respuestas.clear()
+
+    def vigente(self):
+        # Un refresco fallido o con fuentes desactualizadas se reintenta antes, como la caché SQL degradada
+        ahora = time.time()
+        if self.fallido is not None: return ahora - self.fallido < TTL_SQL_DEGRADADO
+        if self.version is None: return False
+        ttl = TTL_SQL if all(e.get('fresco') for e in self.estado.values()) else TTL_SQL_DEGRADADO
+        return ahora - self.instante < ttl
+
+    def refrescar(self):
+        """Si la publicación venció, vuelve a consolidar con los parámetros por defecto (una sola vez a la vez).
+
+        Si no se puede consolidar se sigue sirviendo la versión anterior, pero con el estado del intento
+        fallido (fuentes no frescas), y no se vuelve a intentar hasta TTL_SQL_DEGRADADO.
+        """
+        if self.vigente(): return
+        with self.lock_refresco:
+            if self.vigente(): return
+            final, df_art, df_op, estado = procesar_datos_consolidado(parametros_por_defecto())
+            if not final.empty: return self.publicar(final, df_art, df_op, estado)
+            if not estado or all(e.get('fresco') for e in estado.values()):
+                estado = {**estado, 'proyectado': {'fresco': False, 'instante': None, 'error': "sin proyección o sin datos"}}
+            with self.lock: self.estado, self.fallido = estado, time.time()
+
+    def respuesta(self, clave, generar):
+        with self.lock:
+            cuerpo = self.respuestas.get(clave)
+            if cuerpo is not None:
+                self.respuestas.move_to_end(clave)
+                return cuerpo
+        cuerpo = generar()
+        with self.lock:
+            if clave[0] == self.version:
+                self.respuestas[clave] = cuerpo
+                while len(self.respuestas) > self.max_respuestas: self.respuestas.popitem(last=False)
+        return cuerpo
+
+class ErrorAPI(Exception):
+    def __init__(self, status, mensaje):
+        super().__init__(mensaje)
+        self.status = status
+
+class ManejadorAPI(BaseHTTPRequestHandler):
+    """GET /api/{cobertura,stock,produccion}, /api/articulos/<codigo> y /api/version.
+
+    ?formato=json|csv|arrow (o cabecera Accept), ?campos=A,B para proyectar columnas.
+    Responde 304 si If-None-Match coincide con la versión de los datos y comprime con gzip
+    si el cliente lo acepta. X-Datos-Frescos y X-Fuentes-Desactualizadas avisan cuando
+    alguna fuente se sirvió desde su último dato bueno.
+    """
+
+    publicacion = None
+    server_version = "BrogasAPI/1.0"
+    TIPOS = {'json': 'application/json; charset=utf-8', 'csv': 'text/csv; charset=utf-8',
+             'arrow': 'application/vnd.apache.arrow.stream'}
+    TABLAS = ('cobertura', 'stock', 'produccion')
+
+    def do_GET(self):
+        try:
+            self.atender()
+        except ErrorAPI as e:
+            self.enviar(e.status, json.dumps({'error': str(e)}, ensure_ascii=False).encode('utf-8'), self.TIPOS['json'])
+        except Exception as e:
+            logging.getLogger("brogas.api").exception("Error atendiendo %s", self.path)
+            self.enviar(500, json.dumps({'error': str(e)}, ensure_ascii=False).encode('utf-8'), self.TIPOS['json'])
+
+    def atender(self):
+        url = urlsplit(self.path)
+        partes = [unquote(p) for p in url.path.strip('/').split('/')]
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if partes[0] != 'api' or len(partes) < 2: raise ErrorAPI(404, "ruta desconocida")
+        # Ruta, formato y campos se validan antes del 304: una ruta inválida nunca coincide con un ETag
+        recurso = partes[1]
+        if recurso == 'version' and len(partes) == 2:
+            tabla, codigo = None, None
+        elif recurso == 'articulos' and len(partes) == 3:
+            tabla, codigo = 'cobertura', partes[2].strip().upper()
+        elif recurso in self.TABLAS and len(partes) == 2:
+            tabla, codigo = recurso, None
+        else:
+            raise ErrorAPI(404, f"recurso desconocido: {'/'.join(partes[1:])}")
+        formato = query.get('formato') or next((f for f, t in self.TIPOS.items() if t.split(';')[0] in self.headers.get('Accept', '')), 'json')
+        if formato not in self.TIPOS: raise ErrorAPI(400, f"formato desconocido: {formato} (json, csv, arrow)")
+        campos = tuple(c.strip().upper() for c in query.get('campos', '').split(',') if c.strip())
+
+        pub = self.publicacion
+        pub.refrescar()
+        if pub.version is None: raise ErrorAPI(503, "todavía no hay datos consolidados")
+        with pub.lock:
+            version, instante, tablas, estado = pub.version, pub.instante, pub.tablas, pub.estado
+        desactualizadas = sorted(n for n, e in estado.items() if not e.get('fresco'))
+        cabeceras = {'X-Datos-Frescos': 'false' if desactualizadas else 'true'}
+        if desactualizadas: cabeceras['X-Fuentes-Desactualizadas'] = ", ".join(desactualizadas)
+
+        if tabla is None:
+            fuentes = {n: {k: e.get(k) for k in ('fresco', 'instante', 'error')} for n, e in estado.items()}
+            # El ETag cubre la versión y la frescura de cada fuente, no solo el contenido de las tablas
+            firma = json.dumps({'version': version, 'fuentes': fuentes}, default=str, sort_keys=True).encode('utf-8')
+            etag = f'W/"{hashlib.sha1(firma).hexdigest()[:16]}"'
+            if self.coincide(etag): return self.enviar(304, b"", None, etag, cabeceras=cabeceras)
+            cuerpo = json.dumps({'version': version, 'instante': instante, 'fuentes': fuentes},
+                                default=str, ensure_ascii=False).encode('utf-8')
+            return self.enviar(200, cuerpo, self.TIPOS['json'], etag, cabeceras=cabeceras)
+
+        df = tablas[tabla]
+        faltan = [c for c in campos if c not in df.columns]
+        if faltan: raise ErrorAPI(400, f"campos desconocidos: {', '.join(faltan)}")
+        if codigo is not None and not (df['CODIGOPARTICULAR'] == codigo).any():
+            raise ErrorAPI(404, f"artículo no encontrado: {codigo}")
+        # Mismos datos servidos con otra frescura son otra representación: cambia el ETag y el cliente ve la cabecera nueva
+        etag = f'W/"{version}-{hashlib.sha1(",".join(desactualizadas).encode()).hexdigest()[:8]}"' if desactualizadas else f'W/"{version}"'
+        if self.coincide(etag): return self.enviar(304, b"", None, etag, cabeceras=cabeceras)
+        comprimir = 'gzip' in self.headers.get('Accept-Encoding', '')
+
+        def generar():
+            datos = df if codigo is None else df[df['CODIGOPARTICULAR'] == codigo]
+            if campos: datos = datos[list(campos)]
+            cuerpo = self.serializar(datos, formato, unico=codigo is not None)
+            return gzip.compress(cuerpo, compresslevel=6) if comprimir else cuerpo
+
+        cuerpo = pub.respuesta((version, tabla, codigo, formato, campos, comprimir), generar)
+        self.enviar(200, cuerpo, self.TIPOS[formato], etag, 'gzip' if comprimir else None, cabeceras)
+
+    def coincide(self, etag):
+        return etag in [e.strip() for e in self.headers.get('If-None-Match', '').split(',')]
+
+    @staticmethod
+    def serializar(df, formato, unico=False):
+        if formato == 'csv': return df.to_csv(index=False).encode('utf-8')
+        if formato == 'arrow':
+            import pyarrow as pa
+            tabla = pa.Table.from_pandas(df, preserve_index=False)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, tabla.schema) as w: w.write_table(tabla)
+            return sink.getvalue().to_pybytes()
+        registros = json.loads(df.to_json(orient='records', force_ascii=False))
+        return json.dumps(registros[0] if unico else registros, ensure_ascii=False).encode('utf-8')
+
+    def enviar(self, status, cuerpo, tipo, etag=None, codificacion=None, cabeceras=None):
+        self.send_response(status)
+        if tipo: self.send_header('Content-Type', tipo)
+        if etag: self.send_header('ETag', etag)
+        if codificacion: self.send_header('Content-Encoding', codificacion)
+        for nombre, valor in (cabeceras or {}).items(): self.send_header(nombre, valor)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept, Accept-Encoding')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        if cuerpo: self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        logging.getLogger("brogas.api").info("%s %s", self.address_string(), formato % args)
+
+@st.cache_resource
+def get_publicacion_datos():
+    return PublicacionDatos()
+
+@st.cache_resource
+def get_api():
+    """Servidor HTTP de la API en un hilo del mismo proceso; None si no está configurado o el puerto está tomado."""
+    if not API_PUERTO: return None
+    manejador = type("ManejadorAPIBrogas", (ManejadorAPI,), {'publicacion': get_publicacion_datos()})
+    try:
+        servidor = ThreadingHTTPServer((API_HOST, int(API_PUERTO)), manejador)
+    except OSError as e:
+        logging.getLogger("brogas.api").error("No se pudo abrir la API en %s:%s: %s", API_HOST, API_PUERTO, e)
+        return None
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="api", daemon=True).start()
+    return servidor
+
+# --- 7. PERFILADO ---
+
+class MuestreadorPilas:
+    """Toma la pila de todos los hilos vivos cada INTERVALO_MUESTREO y la acumula en formato
+    "folded" (marco;marco;... conteo), el que leen flamegraph.pl y speedscope. Cada pila arranca
+    con el nombre de su hilo: la extracción corre en los hilos fuente_* del ThreadPoolExecutor,
+    no en el del script, que mientras tanto solo espera en Future.result."""
+
+    def __init__(self, intervalo=INTERVALO_MUESTREO):
+        self.intervalo = intervalo
+        self.pilas = {}
+        self.por_hilo = {}
+        self.fin = threading.Event()
+        self.hilo = threading.Thread(target=self.muestrear, name="perfil", daemon=True)
+
+    def muestrear(self):
+        propio = threading.get_ident()
+        while not self.fin.wait(self.intervalo):
+            nombres = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == propio: continue
+                marcos = []
+                while frame is not None:
+                    marcos.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})")
+                    frame = frame.f_back
+                if not marcos: continue
+                hilo = f"hilo {nombres.get(ident, ident)}"
+                pila = ";".join([hilo, *reversed(marcos)])
+                self.pilas[pila] = self.pilas.get(pila, 0) + 1
+                self.por_hilo[hilo] = self.por_hilo.get(hilo, 0) + 1
+
+    def __enter__(self):
+        self.hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.fin.set()
+        self.hilo.join()
+
+def perfil_pedido():
+    try:
+        if st.query_params.get("perfil") == "1": return True
+        # BROGAS_PERFIL arma un solo rerun por sesión (el primero, con la carga completa), no todos
+        return PERFILAR and not st.session_state.get('perfil_hecho')
+    except Exception:
+        return PERFILAR
+
+def podar_perfiles(directorio=DIR_PERFILES, maximo=MAX_PERFILES):
+    bases = sorted({p.rsplit('.', 1)[0] for p in glob.glob(os.path.join(directorio, "perfil_*.*"))}, reverse=True)
+    for base in bases[maximo:]:
+        for ext in (".prof", ".folded", ".txt"):
+            try: os.remove(base + ext)
+            except OSError: pass
+
+def ejecutar_con_perfil(fn):
+    """Corre fn (un rerun completo) bajo cProfile y el muestreador de pilas y guarda en DIR_PERFILES
+    perfil_<instante>.prof (pstats/snakeviz), .folded (flame graph) y .txt (TOP_PERFIL funciones).
+
+    El flame graph cubre todos los hilos; cProfile solo el del script (un perfil determinista por
+    hilo no se puede cerrar ni volcar desde otro). Quedan los MAX_PERFILES más nuevos.
+    """
+    perfil = cProfile.Profile()
+    t0 = time.perf_counter()
+    try:
+        with MuestreadorPilas() as muestreador:
+            try:
+                perfil.enable()
+            except ValueError:
+                perfil = None  # Python 3.12+: ya hay otro perfil activo en el proceso (otra sesión); queda solo el muestreo
+            try:
+                fn()
+            finally:
+                if perfil is not None: perfil.disable()
+    finally:
+        # También al salir por st.rerun()/st.stop(), que cortan el script con una excepción
+        segundos = time.perf_counter() - t0
+        try:
+            os.makedirs(DIR_PERFILES, exist_ok=True)
+            # Milisegundos y un sufijo aleatorio: un rerun cortado por st.rerun() no pisa el perfil del anterior
+            marca = time.time()
+            base = os.path.join(DIR_PERFILES, f"perfil_{time.strftime('%Y%m%d_%H%M%S', time.localtime(marca))}"
+                                              f"_{int(marca * 1000) % 1000:03d}_{id_sesion() or 'local'}_{uuid.uuid4().hex[:6]}")
+            if perfil is not None: perfil.dump_stats(base + ".prof")
+            with open(base + ".folded", "w", encoding="utf-8") as f:
+                f.writelines(f"{pila} {n}\n" for pila, n in muestreador.pilas.items())
+            texto = io.StringIO()
+            texto.write(f"Rerun de {segundos:.3f} s · muestras cada {INTERVALO_MUESTREO * 1000:g} ms por hilo:\n")
+            texto.writelines(f"  {n:>6}  {hilo}\n" for hilo, n in sorted(muestreador.por_hilo.items(), key=lambda x: -x[1]))
+            texto.write("\ncProfile (solo el hilo del script):\n\n")
+            if perfil is not None:
+                estadisticas = pstats.Stats(perfil, stream=texto).strip_dirs()
+                estadisticas.sort_stats("cumulative").print_stats(TOP_PERFIL)
+                estadisticas.sort_stats("tottime").print_stats(TOP_PERFIL)
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                f.write(texto.getvalue())
+            podar_perfiles()
+            logging.getLogger("brogas.perfil").warning("Perfil guardado en %s.* (%.2f s)", base, segundos)
+            st.toast(f"⏱️ Perfil guardado: {os.path.basename(base)} ({segundos:.2f} s)")
+        except Exception as e:
+            logging.getLogger("brogas.perfil").error("No se pudo guardar el perfil: %s", e)
+        try:
+            st.session_state['perfil_hecho'] = True
+            if "perfil" in st.query_params: del st.query_params["perfil"]  # ?perfil=1 vale para un solo rerun
+        except Exception: pass
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if perfil_pedido():
+        ejecutar_con_perfil(main)
+    else:
+        main()
\ No newline at end of file
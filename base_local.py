@@ -0,0 +1,141 @@
+"""Sustituto local de las bases Firebird para desarrollo y pruebas.
+
+Genera un SQLite por DSN (BROGAS, BROGASML) con las tablas que consulta app.py
+y un Excel de proyección con la tabla PROYECTADO_2. Uso:
+
+    python base_local.py --dir base_local --articulos 2000
+    BROGAS_BASE_LOCAL=base_local BROGAS_EXCEL=base_local/Proyectado.xlsx streamlit run app.py
+"""
+import argparse
+import os
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+import openpyxl
+from openpyxl.worksheet.table import Table
+
+ESQUEMA_BROGAS = """
+CREATE TABLE ARTICULOS (CODIGOARTICULO INTEGER PRIMARY KEY, CODIGOPARTICULAR TEXT, DESCRIPCION TEXT);
+CREATE TABLE DEPOSITOS (CODIGODEPOSITO INTEGER PRIMARY KEY, DESCRIPCION TEXT);
+CREATE TABLE CASILLEROS (CODIGOARTICULO INTEGER, CODIGODEPOSITO INTEGER, STOCKACTUAL NUMERIC);
+CREATE TABLE CUERPOCOMPROBANTES (CODIGOPARTICULAR TEXT, TIPOCOMPROBANTE TEXT, FECHAMODIFICACION TEXT, CANTIDAD NUMERIC, CANTIDADREMITIDA NUMERIC);
+CREATE TABLE CABEZAPEDIDOS (NUMEROCOMPROBANTE INTEGER, TIPOCOMPROBANTE TEXT, ANULADA INTEGER);
+CREATE TABLE CUERPOPEDIDOS (NUMEROCOMPROBANTE INTEGER, TIPOCOMPROBANTE TEXT, CODIGOPARTICULAR TEXT, CODIGODEPOSITO INTEGER, CANTIDAD NUMERIC, CANTIDADCANCELADA NUMERIC, CANTIDADREMITIDA NUMERIC, CANTIDADPREPARADA NUMERIC);
+CREATE TABLE ESTADOSORDENPRODUCCION (CODIGOESTADOOP INTEGER PRIMARY KEY, DESCRIPCION TEXT);
+CREATE TABLE PRODCABEZAORDEN (CODIGOORDEN INTEGER PRIMARY KEY, CODIGOESTADOOP INTEGER, ANULADA INTEGER);
+CREATE TABLE PRODCUERPOORDEN (CODIGOORDEN INTEGER, CODIGOARTICULO INTEGER, CANTIDAD NUMERIC);
+CREATE TABLE PRODDETALLEFINALIZACIONORDEN (CODIGOFINALIZACION INTEGER PRIMARY KEY, CODIGOORDEN INTEGER, CODIGOARTICULO INTEGER, CANTIDAD NUMERIC, FECHA TEXT);
+CREATE INDEX IX_ARTICULOS_CODIGO ON ARTICULOS (CODIGOPARTICULAR);
+CREATE INDEX IX_CASILLEROS_ART ON CASILLEROS (CODIGOARTICULO);
+CREATE INDEX IX_COMPROBANTES_FECHA ON CUERPOCOMPROBANTES (FECHAMODIFICACION);
+CREATE INDEX IX_PEDIDOS_NUM ON CUERPOPEDIDOS (NUMEROCOMPROBANTE, TIPOCOMPROBANTE);
+CREATE INDEX IX_PRODCUERPO_ORDEN ON PRODCUERPOORDEN (CODIGOORDEN);
+CREATE INDEX IX_PRODCUERPO_ART ON PRODCUERPOORDEN (CODIGOARTICULO);
+CREATE INDEX IX_FINALIZACION_ORDEN ON PRODDETALLEFINALIZACIONORDEN (CODIGOORDEN, CODIGOARTICULO);
+CREATE INDEX IX_FINALIZACION_ART ON PRODDETALLEFINALIZACIONORDEN (CODIGOARTICULO);
+"""
+
+ESQUEMA_ML = """
+CREATE TABLE CUERPOCOMPROBANTES (CODIGOPARTICULAR TEXT, TIPOCOMPROBANTE TEXT, FECHAMODIFICACION TEXT, CANTIDAD NUMERIC, CANTIDADREMITIDA NUMERIC);
+CREATE INDEX IX_COMPROBANTES_FECHA ON CUERPOCOMPROBANTES (FECHAMODIFICACION);
+"""
+
+DEPOSITOS = ['CENTRAL', 'EXPEDICION', 'FIZBAY', 'SCRAP', 'SHOWROOM', 'ECOMMERCE_STOCK', 'SALDOS']
+ESTADOS = ['PENDIENTE', 'EN PROCESO', 'TERMINADO']
+TIPOS = ['FA', 'FB', 'FCA', 'FE', 'NC', 'ND']
+FAMILIAS = ['COCINA', 'HORNO', 'ANAFE', 'CAMPANA', 'TERMO', 'ESTUFA']
+
+
+def fecha_aleatoria(rnd, desde, dias):
+    return (desde + timedelta(days=rnd.randrange(dias), seconds=rnd.randrange(86400))).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def crear_comprobantes(conn, rnd, codigos, filas, desde):
+    datos = []
+    for _ in range(filas):
+        cantidad = rnd.randint(1, 20)
+        datos.append((rnd.choice(codigos), rnd.choice(TIPOS), fecha_aleatoria(rnd, desde, 700), cantidad, rnd.randint(0, cantidad)))
+    conn.executemany("INSERT INTO CUERPOCOMPROBANTES VALUES (?, ?, ?, ?, ?)", datos)
+
+
+def crear_brogas(path, rnd, articulos, desde):
+    conn = sqlite3.connect(path)
+    conn.executescript(ESQUEMA_BROGAS)
+    codigos = [f"{1000 + i}-{rnd.choice(['INOX', 'BCO', 'NGO'])}" for i in range(articulos)]
+    conn.executemany("INSERT INTO ARTICULOS VALUES (?, ?, ?)",
+                     [(i + 1, c, f"{rnd.choice(FAMILIAS)} {c}") for i, c in enumerate(codigos)])
+    conn.executemany("INSERT INTO DEPOSITOS VALUES (?, ?)", [(i + 1, d) for i, d in enumerate(DEPOSITOS)])
+    conn.executemany("INSERT INTO CASILLEROS VALUES (?, ?, ?)",
+                     [(a, rnd.randint(1, len(DEPOSITOS)), rnd.randint(0, 80)) for a in range(1, articulos + 1) for _ in range(rnd.randint(1, 3))])
+    crear_comprobantes(conn, rnd, codigos, articulos * 8, desde)
+
+    pedidos, cabezas = [], []
+    for n in range(1, articulos * 2 + 1):
+        cabezas.append((n, 'NP', int(rnd.random() < 0.05)))
+        for _ in range(rnd.randint(1, 3)):
+            pedidos.append((n, 'NP', rnd.choice(codigos), rnd.randint(1, len(DEPOSITOS)), rnd.randint(1, 10),
+                            int(rnd.random() < 0.1), int(rnd.random() < 0.3), int(rnd.random() < 0.2)))
+    conn.executemany("INSERT INTO CABEZAPEDIDOS VALUES (?, ?, ?)", cabezas)
+    conn.executemany("INSERT INTO CUERPOPEDIDOS VALUES (?, ?, ?, ?, ?, ?, ?, ?)", pedidos)
+
+    conn.executemany("INSERT INTO ESTADOSORDENPRODUCCION VALUES (?, ?)", [(i + 1, e) for i, e in enumerate(ESTADOS)])
+    ordenes, cuerpo, finalizaciones = [], [], []
+    for o in range(1, articulos // 2 + 1):
+        ordenes.append((o, rnd.randint(1, len(ESTADOS)), int(rnd.random() < 0.05)))
+        for a in rnd.sample(range(1, articulos + 1), rnd.randint(1, 4)):
+            cantidad = rnd.randint(10, 200)
+            cuerpo.append((o, a, cantidad))
+            for _ in range(rnd.randint(0, 3)):
+                finalizaciones.append((o, a, rnd.randint(1, cantidad // 3 + 1), fecha_aleatoria(rnd, desde, 700)))
+    conn.executemany("INSERT INTO PRODCABEZAORDEN VALUES (?, ?, ?)", ordenes)
+    conn.executemany("INSERT INTO PRODCUERPOORDEN VALUES (?, ?, ?)", cuerpo)
+    finalizaciones.sort(key=lambda f: f[3])
+    conn.executemany("INSERT INTO PRODDETALLEFINALIZACIONORDEN (CODIGOORDEN, CODIGOARTICULO, CANTIDAD, FECHA) VALUES (?, ?, ?, ?)", finalizaciones)
+    conn.commit()
+    conn.close()
+    return codigos
+
+
+def crear_ml(path, rnd, codigos, desde):
+    conn = sqlite3.connect(path)
+    conn.executescript(ESQUEMA_ML)
+    crear_comprobantes(conn, rnd, codigos, len(codigos) * 2, desde)
+    conn.commit()
+    conn.close()
+
+
+def crear_excel(path, rnd, codigos):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "PROYECTADO"
+    ws.append(['Codigo', 'Descripción'] + [f'MES{i}' for i in range(1, 7)])
+    # Como el Excel real: no todos los artículos del ERP están proyectados
+    for c in rnd.sample(codigos, int(len(codigos) * 0.7)):
+        ws.append([c, f"PROYECTADO {c}"] + [rnd.randint(0, 40) for _ in range(6)])
+    ws.add_table(Table(displayName="PROYECTADO_2", ref=f"A1:H{ws.max_row}"))
+    wb.save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dir', default='base_local')
+    parser.add_argument('--articulos', type=int, default=2000)
+    parser.add_argument('--semilla', type=int, default=7)
+    args = parser.parse_args()
+
+    os.makedirs(args.dir, exist_ok=True)
+    for nombre in ('BROGAS.sqlite', 'BROGASML.sqlite', 'Proyectado.xlsx'):
+        path = os.path.join(args.dir, nombre)
+        if os.path.exists(path): os.remove(path)
+
+    rnd = random.Random(args.semilla)
+    desde = datetime(2024, 6, 1)
+    codigos = crear_brogas(os.path.join(args.dir, 'BROGAS.sqlite'), rnd, args.articulos, desde)
+    crear_ml(os.path.join(args.dir, 'BROGASML.sqlite'), rnd, codigos, desde)
+    crear_excel(os.path.join(args.dir, 'Proyectado.xlsx'), rnd, codigos)
+    print(f"✅ Base local creada en {args.dir} ({args.articulos} artículos)")
+
+
+if __name__ == "__main__":
+    main()
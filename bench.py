@@ -0,0 +1,140 @@
+"""Benchmarks de las etapas de app.py, cada uno con su control de equivalencia.
+
+Por etapa se mide la implementación de referencia (equivalencia.py) y cada motor de la app
+sobre el dataset dorado; el resultado de cada motor se compara columna por columna con el de
+la referencia. Un motor más rápido que cambia los números hace fallar la corrida (código de
+salida 1), así que cada optimización llega con su prueba de corrección. Uso:
+
+    python bench.py --repeticiones 5
+    python bench.py --base datos_reproducidos --json informe.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import equivalencia as eq
+
+
+def medir(fn, repeticiones, antes=None):
+    tiempos, res = [], None
+    for _ in range(repeticiones):
+        if antes: antes()
+        t0 = time.perf_counter()
+        res = fn()
+        tiempos.append(time.perf_counter() - t0)
+    return tiempos, res
+
+
+def etapas(app, dir_base):
+    """[(etapa, comparar(ref, alt) -> diferencias, {motor: (fn, preparación por repetición)})]; el primer motor es la referencia."""
+    path_excel = os.environ['BROGAS_EXCEL']
+    params = app.parametros_por_defecto()
+
+    def limpiar_caches():
+        app.get_cache_resultados().limpiar()
+
+    def datos_app():
+        return app.get_datos_sql(params)[:5]
+
+    def comparar_datos(ref, alt):
+        dif = []
+        for nombre, r, a in zip(('art', 'ventas', 'pedidos', 'op', 'canales'), ref, alt):
+            for d in eq.comparar(eq.ordenar(r), eq.ordenar(a)):
+                dif.append({**d, 'tabla': nombre})
+        return dif
+
+    def comparar_vistas(ref, alt):
+        dif = []
+        for nombre, r, a in zip(('cobertura', 'stock', 'produccion'), ref, alt):
+            if list(r['CODIGOPARTICULAR']) != list(a['CODIGOPARTICULAR']):
+                dif.append({'tipo': 'orden', 'lado': nombre, 'n': len(a), 'ejemplos': a['CODIGOPARTICULAR'].head(5).tolist()})
+            for d in eq.comparar(r, a):
+                dif.append({**d, 'tabla': nombre})
+        return dif
+
+    def vistas_app(compartidas):
+        def fn():
+            final, df_art, df_op, _ = app.procesar_datos_consolidado(params)
+            v = app.get_vistas(final, df_art, df_op) if compartidas else app.VistasResultado(final, df_art, df_op)
+            return v.cobertura, v.stock, v.produccion
+        return fn
+
+    ref_proy = eq.referencia_proyectado(path_excel)
+    ref_datos = eq.referencia_datos_sql(app, dir_base)
+    final, df_art, df_op, _ = app.procesar_datos_consolidado(params)
+    return [
+        ('proyectado', lambda r, a: eq.comparar(eq.ordenar(r), eq.ordenar(a)), {
+            'referencia': (lambda: eq.referencia_proyectado(path_excel), None),
+            'parsear_proyectado': (lambda: app.parsear_proyectado(path_excel), None),
+            'espejo': (app.get_proyectado_optimizado, None),
+        }),
+        ('datos_sql', comparar_datos, {
+            'referencia': (lambda: eq.referencia_datos_sql(app, dir_base), None),
+            'preparadas': (datos_app, limpiar_caches),
+            'cache': (datos_app, None),
+        }),
+        ('consolidado', lambda r, a: eq.comparar(eq.ordenar(r), eq.ordenar(a)), {
+            'referencia': (lambda: eq.referencia_consolidado(ref_proy, ref_datos, app.COLUMNAS_CANAL), None),
+            'procesar_datos_consolidado': (lambda: app.procesar_datos_consolidado(params)[0], app.get_cache_consolidados().limpiar),
+            'compartido': (lambda: app.procesar_datos_consolidado(params)[0], None),
+        }),
+        ('vistas', comparar_vistas, {
+            'referencia': (lambda: eq.referencia_vistas(final, df_art, df_op), None),
+            'VistasResultado': (vistas_app(False), None),
+            'compartidas': (vistas_app(True), None),
+        }),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dir', default=os.path.join(eq.DIR_APP, 'base_local', 'golden'), help="dataset dorado (se genera si falta)")
+    parser.add_argument('--base', help="usar esta carpeta tal cual (datos reproducidos) en vez de generar el dataset")
+    parser.add_argument('--articulos', type=int, default=2000)
+    parser.add_argument('--semilla', type=int, default=7)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--json', help="guardar el informe completo en este archivo")
+    args = parser.parse_args()
+
+    dir_base = args.base or args.dir
+    if not args.base: eq.preparar_dataset(dir_base, args.articulos, args.semilla)
+    app = eq.cargar_app(dir_base)
+
+    informe, fallas = {'etapas': [], 'reglas': []}, 0
+    print(f"\n{'etapa':<14}{'motor':<32}{'p50 ms':>10}{'mín ms':>10}{'vs ref':>8}  equivalencia")
+    for etapa, comparar, motores in etapas(app, dir_base):
+        ref_p50, ref_res = None, None
+        for motor, (fn, antes) in motores.items():
+            tiempos, res = medir(fn, args.repeticiones, antes)
+            p50 = statistics.median(tiempos)
+            if ref_res is None:
+                ref_p50, ref_res, diferencias = p50, res, []
+            else:
+                diferencias = comparar(ref_res, res)
+            fallas += len(diferencias)
+            marca = "referencia" if motor == 'referencia' else ("✅" if not diferencias else f"❌ {len(diferencias)} diferencias")
+            print(f"{etapa:<14}{motor:<32}{p50 * 1000:>10.1f}{min(tiempos) * 1000:>10.1f}{ref_p50 / p50:>7.1f}x  {marca}")
+            if diferencias: print(eq.describir(diferencias))
+            informe['etapas'].append({'etapa': etapa, 'motor': motor, 'p50_s': p50, 'min_s': min(tiempos),
+                                      'tiempos_s': tiempos, 'diferencias': diferencias})
+
+    final, df_art, _, _ = app.procesar_datos_consolidado(app.parametros_por_defecto())
+    errores = eq.verificar_reglas(final, df_art, app.get_proyectado_optimizado())
+    if not args.base: errores += eq.verificar_casos_borde(final)
+    for e in errores: print(f"❌ {e}")
+    if not errores: print(f"✅ reglas de negocio{'' if args.base else ' y casos borde'}")
+    informe['reglas'] = errores
+    fallas += len(errores)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False, default=str)
+        print(f"Informe guardado en {args.json}")
+    sys.exit(1 if fallas else 0)
+
+
+if __name__ == "__main__":
+    main()
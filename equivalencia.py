@@ -0,0 +1,339 @@
+"""Arnés de equivalencia: implementación de referencia contra los motores de app.py.
+
+La referencia es el cálculo original, congelado acá: las consultas literales con pd.read_sql
+sobre conexiones nuevas, el Excel leído con openpyxl y la consolidación tal como estaba. Cada
+camino optimizado (espejo del Excel, conexiones preparadas, saldo de producción acotado a las
+órdenes abiertas, consolidación) se corre sobre el mismo dataset dorado y se compara columna por
+columna con tolerancia. Además se verifican las reglas de negocio y los casos borde con su valor esperado.
+
+El dataset dorado es el de base_local.py más unos artículos armados a mano (CASOS_BORDE); con
+--base se puede apuntar a una carpeta existente con los mismos archivos (datos reproducidos).
+Lo usa bench.py en cada corrida; solo:
+
+    python equivalencia.py --dir golden --articulos 2000
+"""
+import argparse
+import importlib
+import os
+import sqlite3
+import sys
+import tempfile
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+import base_local
+
+DIR_APP = os.path.dirname(os.path.abspath(__file__))
+RTOL = 1e-9
+ATOL = 1e-6
+TOLERANCIAS = {}                 # columna -> (rtol, atol) cuando hace falta aflojar alguna
+
+# --- REFERENCIA (no tocar: es la vara contra la que se mide todo lo demás) ---
+R_ART = "SELECT A.CODIGOPARTICULAR, A.DESCRIPCION, SUM(C.STOCKACTUAL) as STOCK FROM ARTICULOS A LEFT JOIN CASILLEROS C ON A.CODIGOARTICULO = C.CODIGOARTICULO LEFT JOIN DEPOSITOS D ON C.CODIGODEPOSITO = D.CODIGODEPOSITO WHERE D.DESCRIPCION NOT IN ('COMPRAS NC','ALUCOLOR','ECOMMERCE_FULL_BRO','ECOMMERCE_FULL_1','CONTROL DE CALIDAD', 'SALDOS','ECOMMERCE_FACTURACIÓN', 'ECOMMERCE_STOCK', 'SCRAP', 'SERVICIO TECNICO', 'SHOWROOM', 'M. NO CONFORMES') GROUP BY A.CODIGOPARTICULAR, A.DESCRIPCION"
+R_VENTAS = "SELECT CODIGOPARTICULAR, SUM(CANTIDAD - CANTIDADREMITIDA) as PENDIENTES_VENTAS FROM CUERPOCOMPROBANTES WHERE FECHAMODIFICACION > '{desde}' AND TIPOCOMPROBANTE IN ({tipos}) AND (CANTIDAD - CANTIDADREMITIDA) > 0 GROUP BY CODIGOPARTICULAR"
+R_PEDIDOS = "SELECT CP.CODIGOPARTICULAR, SUM(CP.CANTIDAD) as PEDIDOS_NUEVOS FROM CUERPOPEDIDOS CP INNER JOIN CABEZAPEDIDOS CB ON CP.NUMEROCOMPROBANTE = CB.NUMEROCOMPROBANTE AND CP.TIPOCOMPROBANTE = CB.TIPOCOMPROBANTE INNER JOIN DEPOSITOS D ON CP.CODIGODEPOSITO = D.CODIGODEPOSITO WHERE CB.ANULADA = 0 AND CP.CANTIDADCANCELADA = 0 AND CP.CANTIDADREMITIDA = 0 AND CP.CANTIDADPREPARADA = 0 AND D.DESCRIPCION IN ('EXPEDICION', 'FIZBAY') GROUP BY CP.CODIGOPARTICULAR"
+R_OP = "SELECT A.CODIGOPARTICULAR, SUM(CP.CANTIDAD) as CANTIDAD_TOTAL_OP, SUM(CP.CANTIDAD - COALESCE(ENTREGAS.TOTAL_ENTREGADO, 0)) as EN_PRODUCCION FROM PRODCABEZAORDEN H INNER JOIN PRODCUERPOORDEN CP ON H.CODIGOORDEN = CP.CODIGOORDEN INNER JOIN ARTICULOS A ON CP.CODIGOARTICULO = A.CODIGOARTICULO LEFT JOIN (SELECT CODIGOORDEN, CODIGOARTICULO, SUM(CANTIDAD) as TOTAL_ENTREGADO FROM PRODDETALLEFINALIZACIONORDEN GROUP BY CODIGOORDEN, CODIGOARTICULO) ENTREGAS ON CP.CODIGOORDEN = ENTREGAS.CODIGOORDEN AND CP.CODIGOARTICULO = ENTREGAS.CODIGOARTICULO LEFT JOIN ESTADOSORDENPRODUCCION E ON H.CODIGOESTADOOP = E.CODIGOESTADOOP WHERE H.ANULADA = 0 AND COALESCE(E.DESCRIPCION, '') <> 'TERMINADO' AND (CP.CANTIDAD - COALESCE(ENTREGAS.TOTAL_ENTREGADO, 0)) > 0 GROUP BY A.CODIGOPARTICULAR"
+R_CANAL = "SELECT CODIGOPARTICULAR, SUM(CANTIDAD - CANTIDADREMITIDA) as PENDIENTE FROM CUERPOCOMPROBANTES WHERE FECHAMODIFICACION > '{desde}' GROUP BY CODIGOPARTICULAR"
+R_CANAL_FACTURAS = "SELECT CODIGOPARTICULAR, SUM(CANTIDAD - CANTIDADREMITIDA) as PENDIENTE FROM CUERPOCOMPROBANTES WHERE FECHAMODIFICACION > '{desde}' AND TIPOCOMPROBANTE IN ({tipos}) AND (CANTIDAD - CANTIDADREMITIDA) > 0 GROUP BY CODIGOPARTICULAR"
+
+
+def referencia_proyectado(path):
+    wb = openpyxl.load_workbook(path, data_only=True, read_only=False)
+    res_data = None
+    for sheet in wb.worksheets:
+        if "PROYECTADO_2" in sheet.tables:
+            data = [[cell.value for cell in row] for row in sheet[sheet.tables["PROYECTADO_2"].ref]]
+            if len(data) > 1: res_data = pd.DataFrame(data[1:], columns=data[0])
+            break
+    wb.close()
+    if res_data is None: return pd.DataFrame()
+
+    df = res_data
+    df.columns = df.columns.astype(str).str.strip()
+    meses = ['MES2', 'MES3', 'MES4']
+    for m in meses:
+        df[m] = pd.to_numeric(df[m], errors='coerce').fillna(0) if m in df.columns else 0
+    df['PEDIDO_PROYECTADO'] = df[meses].sum(axis=1)
+    col_cod = 'Codigo' if 'Codigo' in df.columns else df.columns[0]
+    col_des = 'Descripción' if 'Descripción' in df.columns else (df.columns[1] if len(df.columns) > 1 else 'Descripción')
+    df = df[[col_cod, col_des, 'PEDIDO_PROYECTADO']].rename(columns={col_cod: 'CODIGOPARTICULAR', col_des: 'DESCRIPCION'})
+    df['CODIGOPARTICULAR'] = df['CODIGOPARTICULAR'].astype(str).str.strip().str.upper()
+    return df
+
+
+def leer_sql(base, dsn, sql):
+    conn = sqlite3.connect(f"file:{os.path.join(base, dsn + '.sqlite')}?mode=ro", uri=True)
+    try:
+        df = pd.read_sql(sql, conn)
+    finally:
+        conn.close()
+    df.columns = df.columns.str.upper()
+    return df
+
+
+def referencia_datos_sql(app, base):
+    """(art, ventas, pedidos, op, canales) con las consultas literales y los parámetros por defecto."""
+    params = app.parametros_por_defecto()
+    tipos = ", ".join(f"'{t}'" for t in params.tipos_comprobante)
+    dsn = app.FUENTE_PRINCIPAL['dsn']
+    df_art = leer_sql(base, dsn, R_ART)
+    df_ventas = leer_sql(base, dsn, R_VENTAS.format(desde=params.fecha_ventas, tipos=tipos))
+    df_pedidos = leer_sql(base, dsn, R_PEDIDOS)
+    df_op = leer_sql(base, dsn, R_OP)
+    df_canales = None
+    for fu, col in zip(app.FUENTES_CANAL, app.COLUMNAS_CANAL):
+        sqls = {'q_canal': R_CANAL, 'q_canal_facturas': R_CANAL_FACTURAS}
+        partes = [leer_sql(base, fu['dsn'], sqls[c].format(desde=params.fecha_canal(fu), tipos=tipos)) for c in fu['consultas']]
+        df = pd.concat(partes).groupby('CODIGOPARTICULAR', as_index=False)['PENDIENTE'].sum().rename(columns={'PENDIENTE': col})
+        df_canales = df if df_canales is None else df_canales.merge(df, on='CODIGOPARTICULAR', how='outer')
+    return df_art, df_ventas, df_pedidos, df_op, df_canales
+
+
+def referencia_consolidado(df_proy, datos, columnas_canal):
+    df_art, df_ventas, df_pedidos, df_op, df_canales = datos
+    final = df_proy.merge(df_art, on='CODIGOPARTICULAR', how='left', suffixes=('_EXCEL', '_SQL'))
+    final['DESCRIPCION'] = final['DESCRIPCION_SQL'].fillna(final['DESCRIPCION_EXCEL'])
+    final.drop(columns=['DESCRIPCION_SQL', 'DESCRIPCION_EXCEL'], inplace=True, errors='ignore')
+    for d in (df_ventas, df_pedidos, df_canales, df_op):
+        if d is not None and not d.empty: final = final.merge(d, on='CODIGOPARTICULAR', how='left')
+    for c in columnas_canal:
+        if c not in final.columns: final[c] = 0
+
+    final = final.fillna(0)
+    final['PENDIENTE_TOTAL'] = final.get('PENDIENTES_VENTAS', 0) + final.get('PEDIDOS_NUEVOS', 0) + final[columnas_canal].sum(axis=1)
+    final['STOCK_NETO'] = final['STOCK'] - final['PENDIENTE_TOTAL']
+    final['COBERTURA_MESES'] = np.where(final['PEDIDO_PROYECTADO'] > 0, (final['STOCK_NETO'] / final['PEDIDO_PROYECTADO']) * 3, 999)
+    final.loc[(final['STOCK_NETO'] <= 0), 'COBERTURA_MESES'] = 0
+
+    cols_order = ['CODIGOPARTICULAR', 'DESCRIPCION', 'PEDIDO_PROYECTADO', 'STOCK', 'PENDIENTE_TOTAL', *columnas_canal, 'STOCK_NETO', 'COBERTURA_MESES', 'EN_PRODUCCION']
+    for c in cols_order:
+        if c not in final.columns: final[c] = 0
+    return final[cols_order]
+
+
+def referencia_vistas(final, df_art, df_op):
+    """(cobertura, stock, producción) como las armaba cada sesión en las pestañas de main()."""
+    if df_op is not None and not df_op.empty:
+        df_mostrar = final.merge(df_op[['CODIGOPARTICULAR', 'EN_PRODUCCION']].rename(columns={'EN_PRODUCCION': 'SALDO PENDIENTE'}), on='CODIGOPARTICULAR', how='left')
+    else:
+        df_mostrar = final.copy()
+        df_mostrar['SALDO PENDIENTE'] = 0
+    df_mostrar['SALDO PENDIENTE'] = df_mostrar['SALDO PENDIENTE'].fillna(0)
+    codigos = final['CODIGOPARTICULAR'].unique()
+    df_stock = df_art[df_art['CODIGOPARTICULAR'].isin(codigos)]
+    df_prod = df_op[df_op['CODIGOPARTICULAR'].isin(codigos)].merge(final[['CODIGOPARTICULAR', 'DESCRIPCION']].drop_duplicates(), on='CODIGOPARTICULAR', how='left')
+    df_prod = df_prod.rename(columns={'CANTIDAD_TOTAL_OP': 'CANT. TOTAL OP', 'EN_PRODUCCION': 'SALDO PENDIENTE'})
+    df_prod = df_prod[[c for c in ['CODIGOPARTICULAR', 'DESCRIPCION', 'CANT. TOTAL OP', 'SALDO PENDIENTE'] if c in df_prod.columns]]
+    return tuple(df.sort_values('CODIGOPARTICULAR', ascending=True, kind='stable') for df in (df_mostrar, df_stock, df_prod))
+
+
+# --- DATASET DORADO ---
+# Artículos agregados a mano: (código en el Excel, en ARTICULOS, stock, MES2-4, ventas pendientes,
+# (cantidad OP, entregado)) y lo que tiene que salir. None en ARTICULOS: solo existe en el Excel.
+CASOS_BORDE = [
+    {'excel': 'BORDE-SIN-PROY', 'sql': 'BORDE-SIN-PROY', 'stock': 50, 'meses': (0, 0, 0),
+     'esperado': {'PEDIDO_PROYECTADO': 0, 'STOCK_NETO': 50, 'COBERTURA_MESES': 999, 'DESCRIPCION': 'SQL BORDE-SIN-PROY'}},
+    {'excel': 'BORDE-CERO-SIN-PROY', 'sql': 'BORDE-CERO-SIN-PROY', 'stock': 0, 'meses': (0, 0, 0),
+     'esperado': {'STOCK_NETO': 0, 'COBERTURA_MESES': 0}},
+    {'excel': 'BORDE-NETO-NEG', 'sql': 'BORDE-NETO-NEG', 'stock': 5, 'meses': (10, 10, 10), 'ventas': 10,
+     'esperado': {'PENDIENTE_TOTAL': 10, 'STOCK_NETO': -5, 'COBERTURA_MESES': 0}},
+    {'excel': 'BORDE-SOLO-EXCEL', 'sql': None, 'stock': 0, 'meses': (5, 5, 5),
+     'esperado': {'STOCK': 0, 'STOCK_NETO': 0, 'COBERTURA_MESES': 0, 'DESCRIPCION': 'EXCEL BORDE-SOLO-EXCEL'}},
+    {'excel': '  borde-minusc ', 'sql': 'BORDE-MINUSC', 'stock': 9, 'meses': (1, 1, 1),
+     'esperado': {'PEDIDO_PROYECTADO': 3, 'COBERTURA_MESES': 9, 'DESCRIPCION': 'SQL BORDE-MINUSC'}},
+    {'excel': 'BORDE-TEXTO', 'sql': 'BORDE-TEXTO', 'stock': 12, 'meses': ('n/d', None, 6), 'op': (20, 5),
+     'esperado': {'PEDIDO_PROYECTADO': 6, 'COBERTURA_MESES': 6, 'EN_PRODUCCION': 15}},
+]
+
+
+def codigo_caso(caso):
+    return caso['excel'].strip().upper()
+
+
+def agregar_casos_borde(dir_base):
+    conn = sqlite3.connect(os.path.join(dir_base, 'BROGAS.sqlite'))
+    id_art = conn.execute("SELECT MAX(CODIGOARTICULO) FROM ARTICULOS").fetchone()[0]
+    id_orden = conn.execute("SELECT MAX(CODIGOORDEN) FROM PRODCABEZAORDEN").fetchone()[0]
+    central = conn.execute("SELECT CODIGODEPOSITO FROM DEPOSITOS WHERE DESCRIPCION = 'CENTRAL'").fetchone()[0]
+    pendiente = conn.execute("SELECT CODIGOESTADOOP FROM ESTADOSORDENPRODUCCION WHERE DESCRIPCION = 'PENDIENTE'").fetchone()[0]
+    for caso in CASOS_BORDE:
+        if caso['sql'] is None: continue
+        id_art += 1
+        conn.execute("INSERT INTO ARTICULOS VALUES (?, ?, ?)", (id_art, caso['sql'], f"SQL {caso['sql']}"))
+        conn.execute("INSERT INTO CASILLEROS VALUES (?, ?, ?)", (id_art, central, caso['stock']))
+        if caso.get('ventas'):
+            conn.execute("INSERT INTO CUERPOCOMPROBANTES VALUES (?, 'FA', '2025-10-01 00:00:00', ?, 0)", (caso['sql'], caso['ventas']))
+        if caso.get('op'):
+            id_orden += 1
+            cantidad, entregado = caso['op']
+            conn.execute("INSERT INTO PRODCABEZAORDEN VALUES (?, ?, 0)", (id_orden, pendiente))
+            conn.execute("INSERT INTO PRODCUERPOORDEN VALUES (?, ?, ?)", (id_orden, id_art, cantidad))
+            conn.execute("INSERT INTO PRODDETALLEFINALIZACIONORDEN (CODIGOORDEN, CODIGOARTICULO, CANTIDAD, FECHA) VALUES (?, ?, ?, '2025-10-01 00:00:00')",
+                         (id_orden, id_art, entregado))
+    conn.commit()
+    conn.close()
+
+    path = os.path.join(dir_base, 'Proyectado.xlsx')
+    wb = openpyxl.load_workbook(path)
+    ws = wb['PROYECTADO']
+    for caso in CASOS_BORDE:
+        ws.append([caso['excel'], f"EXCEL {codigo_caso(caso)}", 0, *caso['meses'], 0, 0])
+    ws.tables['PROYECTADO_2'].ref = f"A1:H{ws.max_row}"
+    wb.save(path)
+
+
+def preparar_dataset(dir_base, articulos, semilla):
+    """Genera el dataset dorado en dir_base (base_local.py + CASOS_BORDE) si todavía no existe."""
+    if os.path.exists(os.path.join(dir_base, 'BROGAS.sqlite')): return
+    sys_argv = sys.argv
+    sys.argv = ['base_local.py', '--dir', dir_base, '--articulos', str(articulos), '--semilla', str(semilla)]
+    try:
+        base_local.main()
+    finally:
+        sys.argv = sys_argv
+    agregar_casos_borde(dir_base)
+
+
+def cargar_app(dir_base):
+    """Importa app.py apuntado al dataset (sin servidor de Streamlit: modo 'bare')."""
+    os.environ['BROGAS_BASE_LOCAL'] = dir_base
+    os.environ['BROGAS_EXCEL'] = os.path.join(dir_base, 'Proyectado.xlsx')
+    for var, prefijo in (('BROGAS_LOGS', 'eq_logs_'), ('BROGAS_ESPEJO', 'eq_espejo_'), ('BROGAS_SNAPSHOTS', 'eq_snap_'),
+                         ('BROGAS_ALERTAS', 'eq_alertas_')):
+        os.environ.setdefault(var, tempfile.mkdtemp(prefix=prefijo))
+    import streamlit.logger
+    streamlit.logger.set_log_level('error')
+    if DIR_APP not in sys.path: sys.path.insert(0, DIR_APP)
+    return importlib.import_module('app')
+
+
+# --- COMPARACIÓN ---
+
+def escalar(v):
+    return v.item() if isinstance(v, np.generic) else v
+
+
+def comparar(ref, alt, clave='CODIGOPARTICULAR', tolerancias=None, rtol=RTOL, atol=ATOL):
+    """Diferencias entre dos DataFrames alineados por clave; lista vacía si son equivalentes.
+
+    Numéricas con np.isclose (tolerancias por columna en TOLERANCIAS o el argumento), el resto
+    por igualdad exacta con NaN == NaN. El orden de filas no importa.
+    """
+    tolerancias = {**TOLERANCIAS, **(tolerancias or {})}
+    dif = []
+    faltan = [c for c in ref.columns if c not in alt.columns]
+    sobran = [c for c in alt.columns if c not in ref.columns]
+    if faltan or sobran: dif.append({'tipo': 'columnas', 'faltan': faltan, 'sobran': sobran})
+    for nombre, df in (('referencia', ref), ('alternativa', alt)):
+        duplicadas = df[clave].duplicated()
+        if duplicadas.any(): dif.append({'tipo': 'duplicadas', 'lado': nombre, 'n': int(duplicadas.sum()), 'ejemplos': df.loc[duplicadas, clave].head(5).tolist()})
+    r = ref.drop_duplicates(clave).set_index(clave)
+    a = alt.drop_duplicates(clave).set_index(clave)
+    for nombre, solo in (('solo_referencia', r.index.difference(a.index)), ('solo_alternativa', a.index.difference(r.index))):
+        if len(solo): dif.append({'tipo': 'filas', 'lado': nombre, 'n': len(solo), 'ejemplos': solo[:5].tolist()})
+
+    comunes = r.index.intersection(a.index)
+    for col in [c for c in r.columns if c in a.columns]:
+        x, y = r.loc[comunes, col], a.loc[comunes, col]
+        if pd.api.types.is_numeric_dtype(x) and pd.api.types.is_numeric_dtype(y):
+            rt, at = tolerancias.get(col, (rtol, atol))
+            xf, yf = x.astype(float).to_numpy(), y.astype(float).to_numpy()
+            ok = np.isclose(xf, yf, rtol=rt, atol=at, equal_nan=True)
+            max_abs = float(np.nanmax(np.abs(xf - yf))) if len(xf) else 0.0
+        else:
+            ok = ((x.astype(object) == y.astype(object)) | (x.isna() & y.isna())).to_numpy()
+            max_abs = None
+        if not ok.all():
+            malas = comunes[~ok]
+            dif.append({'tipo': 'valores', 'columna': col, 'n': int((~ok).sum()), 'max_abs': max_abs,
+                        'ejemplos': [(k, escalar(x[k]), escalar(y[k])) for k in malas[:5]]})
+    return dif
+
+
+def verificar_reglas(final, df_art, df_proy):
+    """Reglas de negocio de la consolidación, independientes de la referencia."""
+    errores = []
+    neto_no_positivo = final['STOCK_NETO'] <= 0
+    mal = neto_no_positivo & (final['COBERTURA_MESES'] != 0)
+    if mal.any(): errores.append(f"COBERTURA_MESES distinta de 0 con STOCK_NETO <= 0: {final.loc[mal, 'CODIGOPARTICULAR'].head(5).tolist()}")
+    mal = ~neto_no_positivo & (final['PEDIDO_PROYECTADO'] <= 0) & (final['COBERTURA_MESES'] != 999)
+    if mal.any(): errores.append(f"sin proyección y con stock neto la cobertura debe ser 999: {final.loc[mal, 'CODIGOPARTICULAR'].head(5).tolist()}")
+    con_proy = ~neto_no_positivo & (final['PEDIDO_PROYECTADO'] > 0)
+    esperada = final['STOCK_NETO'] / final['PEDIDO_PROYECTADO'] * 3
+    mal = con_proy & ~np.isclose(final['COBERTURA_MESES'], esperada, rtol=RTOL, atol=ATOL)
+    if mal.any(): errores.append(f"COBERTURA_MESES != STOCK_NETO / PEDIDO_PROYECTADO * 3: {final.loc[mal, 'CODIGOPARTICULAR'].head(5).tolist()}")
+    mal = ~np.isclose(final['STOCK_NETO'], final['STOCK'] - final['PENDIENTE_TOTAL'], rtol=RTOL, atol=ATOL)
+    if mal.any(): errores.append(f"STOCK_NETO != STOCK - PENDIENTE_TOTAL: {final.loc[mal, 'CODIGOPARTICULAR'].head(5).tolist()}")
+
+    # Descripción: la del ERP si el artículo existe ahí, si no la del Excel (fila a fila, el merge conserva el orden)
+    if len(final) == len(df_proy):
+        desc_sql = final['CODIGOPARTICULAR'].map(df_art.drop_duplicates('CODIGOPARTICULAR').set_index('CODIGOPARTICULAR')['DESCRIPCION'])
+        esperada = desc_sql.fillna(pd.Series(df_proy['DESCRIPCION'].to_numpy(), index=final.index))
+        mal = ~((final['DESCRIPCION'] == esperada) | (final['DESCRIPCION'].isna() & esperada.isna()))
+        if mal.any(): errores.append(f"DESCRIPCION no respeta ERP → Excel: {final.loc[mal, 'CODIGOPARTICULAR'].head(5).tolist()}")
+    else:
+        errores.append(f"el consolidado tiene {len(final)} filas y la proyección {len(df_proy)}")
+    return errores
+
+
+def verificar_casos_borde(final):
+    errores = []
+    filas = final.drop_duplicates('CODIGOPARTICULAR').set_index('CODIGOPARTICULAR')
+    for caso in CASOS_BORDE:
+        codigo = codigo_caso(caso)
+        if codigo not in filas.index:
+            errores.append(f"{codigo}: falta en el consolidado")
+            continue
+        for col, valor in caso['esperado'].items():
+            obtenido = filas.at[codigo, col]
+            igual = obtenido == valor if isinstance(valor, str) else np.isclose(float(obtenido), valor, rtol=RTOL, atol=ATOL)
+            if not igual: errores.append(f"{codigo}.{col}: esperado {valor!r}, obtenido {obtenido!r}")
+    return errores
+
+
+def ordenar(df, clave='CODIGOPARTICULAR'):
+    return df.sort_values(clave).reset_index(drop=True)
+
+
+def describir(diferencias):
+    lineas = []
+    for d in diferencias:
+        if d['tipo'] == 'valores':
+            lineas.append(f"  {d['columna']}: {d['n']} valores distintos (máx abs {d['max_abs']}) · p. ej. {d['ejemplos'][:3]}")
+        elif d['tipo'] == 'columnas':
+            lineas.append(f"  columnas: faltan {d['faltan']} · sobran {d['sobran']}")
+        else:
+            lineas.append(f"  {d['tipo']} ({d['lado']}): {d['n']} · p. ej. {d['ejemplos']}")
+    return "\n".join(lineas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dir', default=os.path.join(DIR_APP, 'base_local', 'golden'), help="dataset dorado (se genera si falta)")
+    parser.add_argument('--base', help="usar esta carpeta tal cual (datos reproducidos) en vez de generar el dataset")
+    parser.add_argument('--articulos', type=int, default=2000)
+    parser.add_argument('--semilla', type=int, default=7)
+    args = parser.parse_args()
+
+    dir_base = args.base or args.dir
+    if not args.base: preparar_dataset(dir_base, args.articulos, args.semilla)
+    app = cargar_app(dir_base)
+    ref_proy = referencia_proyectado(os.environ['BROGAS_EXCEL'])
+    ref_final = referencia_consolidado(ref_proy, referencia_datos_sql(app, dir_base), app.COLUMNAS_CANAL)
+    final, df_art, _, _ = app.procesar_datos_consolidado(app.parametros_por_defecto())
+
+    fallas = 0
+    diferencias = comparar(ordenar(ref_final), ordenar(final))
+    print(f"{'✅' if not diferencias else '❌'} consolidado: {len(final):,} filas")
+    if diferencias: print(describir(diferencias))
+    errores = verificar_reglas(final, df_art, app.get_proyectado_optimizado())
+    if not args.base: errores += verificar_casos_borde(final)
+    for e in errores: print(f"❌ {e}")
+    fallas += len(diferencias) + len(errores)
+    sys.exit(1 if fallas else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+"""Excepciones compartidas por app.py y los objetos que guarda en st.cache_resource.
+
+Streamlit vuelve a ejecutar app.py en un módulo nuevo en cada rerun, así que una clase
+definida ahí es otra en cada ejecución, mientras que el pool de conexiones cacheado sigue
+lanzando la de la primera: un `except` con la clase del rerun actual nunca la atraparía.
+Acá se importan una sola vez por proceso y la identidad de la clase no cambia.
+"""
+
+
+class FuenteNoDisponible(Exception):
+    """El DSN no responde o su circuito está abierto; se sirve el último dato bueno."""
@@ -0,0 +1,196 @@
+"""Prueba de carga: N sesiones simultáneas de app.py contra la base local.
+
+Cada sesión es un AppTest de Streamlit (mismo proceso, como en el servidor real)
+que recorre un guion de acciones: cambios de pestaña, descargas y "🔄 Actualizar".
+Al final informa latencia de rerun p50/p95/p99, memoria del proceso y cuántas
+consultas a la base disparó cada sesión (leídas del log de consultas). Uso:
+
+    python prueba_carga.py --sesiones 30 --acciones 8
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+DIR_APP = os.path.dirname(os.path.abspath(__file__))
+PATH_APP = os.path.join(DIR_APP, "app.py")
+
+# Pesos del guion. En el navegador cambiar de pestaña no produce rerun (las pestañas ya
+# están renderizadas) y la descarga sí: el botón de descarga vuelve a ejecutar el script.
+ACCIONES = {'pestana': 5, 'descarga': 2, 'actualizar': 1}
+
+
+def rss_actual():
+    """Memoria residente del proceso en bytes (Linux: /proc; resto: pico de getrusage)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return rss_pico()
+
+
+def rss_pico():
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico if sys.platform == "darwin" else pico * 1024
+
+
+def percentil(valores, p):
+    if not valores: return float('nan')
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100
+    i = int(k)
+    return ordenados[i] + (ordenados[min(i + 1, len(ordenados) - 1)] - ordenados[i]) * (k - i)
+
+
+def preparar_runtime_compartido():
+    """Un solo Runtime simulado para todas las sesiones, como el del servidor.
+
+    AppTest crea un Runtime simulado al comenzar cada run y lo borra al terminar: con
+    varias sesiones en hilos se pisan entre sí, y además st.cache_data arranca vacío en
+    cada rerun. Se instala uno persistente y se desvía la asignación de AppTest a un
+    espacio de nombres descartable.
+    """
+    from contextlib import nullcontext
+    from unittest.mock import MagicMock
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.testing.v1 import app_test
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    app_test.Runtime = types.SimpleNamespace(_instance=None)
+    config.set_option("global.appTest", True)
+    app_test.patch_config_options = lambda *a, **k: nullcontext()
+
+
+def simular_sesion(n, acciones, semilla, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    rnd = random.Random(semilla + n)
+    at = AppTest.from_file(PATH_APP, default_timeout=timeout)
+    tiempos = []
+
+    def medir(accion, fn):
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append((accion, time.perf_counter() - t0))
+        if at.exception: raise RuntimeError(f"sesión {n}: {at.exception[0].value}")
+
+    medir('inicio', at.run)
+    for _ in range(acciones):
+        accion = rnd.choices(list(ACCIONES), weights=list(ACCIONES.values()))[0]
+        if accion == 'pestana':
+            tiempos.append((accion, 0.0))  # sin ida al servidor
+        elif accion == 'descarga':
+            medir(accion, at.run)
+        else:
+            boton = next(b for b in at.button if b.label == "🔄 Actualizar")
+            medir(accion, lambda: boton.click().run())
+    return at.session_state['id_sesion'], tiempos
+
+
+def consultas_por_sesion(path_log):
+    conteo = Counter()
+    if not os.path.exists(path_log): return conteo
+    with open(path_log, encoding='utf-8') as f:
+        for linea in f:
+            conteo[json.loads(linea).get('sesion')] += 1
+    return conteo
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sesiones', type=int, default=20)
+    parser.add_argument('--acciones', type=int, default=6, help="acciones por sesión después de la carga inicial")
+    parser.add_argument('--base', default=os.path.join(DIR_APP, 'base_local'), help="carpeta de base_local.py (se crea si falta)")
+    parser.add_argument('--articulos', type=int, default=2000)
+    parser.add_argument('--semilla', type=int, default=7)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--json', help="guardar el informe completo en este archivo")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.base, 'BROGAS.sqlite')):
+        subprocess.run([sys.executable, os.path.join(DIR_APP, 'base_local.py'), '--dir', args.base,
+                        '--articulos', str(args.articulos)], check=True)
+    dir_logs = tempfile.mkdtemp(prefix="carga_logs_")
+    os.environ['BROGAS_BASE_LOCAL'] = args.base
+    os.environ['BROGAS_EXCEL'] = os.path.join(args.base, 'Proyectado.xlsx')
+    os.environ['BROGAS_LOGS'] = dir_logs
+    # Snapshots, alertas y espejo van a carpetas temporales: la carga no toca el historial, la línea
+    # base de alertas ni el outbox de la instalación, y no dispara el notificador real
+    for var, prefijo in (('BROGAS_SNAPSHOTS', 'carga_snap_'), ('BROGAS_ALERTAS', 'carga_alertas_'), ('BROGAS_ESPEJO', 'carga_espejo_')):
+        os.environ[var] = tempfile.mkdtemp(prefix=prefijo)
+    os.environ.pop('BROGAS_NOTIFICADOR', None)
+
+    preparar_runtime_compartido()
+    rss_inicial = rss_actual()
+    muestras_rss = [rss_inicial]
+    fin = threading.Event()
+
+    def muestrear():
+        while not fin.wait(0.2): muestras_rss.append(rss_actual())
+
+    hilo_rss = threading.Thread(target=muestrear, daemon=True)
+    hilo_rss.start()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sesiones) as ex:
+        futuros = [ex.submit(simular_sesion, n, args.acciones, args.semilla, args.timeout) for n in range(args.sesiones)]
+        resultados = [f.result() for f in futuros]
+    duracion = time.perf_counter() - t0
+    fin.set()
+    hilo_rss.join()
+    rss_final = rss_actual()
+
+    por_accion = defaultdict(list)
+    for _, tiempos in resultados:
+        for accion, seg in tiempos:
+            if accion != 'pestana': por_accion[accion].append(seg)
+    reruns = [s for v in por_accion.values() for s in v]
+    consultas = consultas_por_sesion(os.path.join(dir_logs, 'consultas.log'))
+    por_sesion = [consultas.get(sid, 0) for sid, _ in resultados]
+
+    informe = {
+        'sesiones': args.sesiones, 'acciones_por_sesion': args.acciones, 'duracion_s': round(duracion, 2),
+        'reruns': len(reruns),
+        'latencia_s': {k: {'n': len(v), 'p50': percentil(v, 50), 'p95': percentil(v, 95), 'p99': percentil(v, 99)}
+                       for k, v in [('todas', reruns), *sorted(por_accion.items())]},
+        'memoria_mb': {'inicial': rss_inicial / 2**20, 'final': rss_final / 2**20,
+                       'pico': max(max(muestras_rss), rss_final) / 2**20,
+                       'por_sesion': (rss_final - rss_inicial) / 2**20 / args.sesiones},
+        'consultas_bd': {'total': sum(consultas.values()), 'por_sesion_media': statistics.mean(por_sesion),
+                         'por_sesion_max': max(por_sesion), 'sin_sesion': consultas.get(None, 0),
+                         'detalle': {sid: consultas.get(sid, 0) for sid, _ in resultados}},
+    }
+
+    print(f"\n📊 {args.sesiones} sesiones · {len(reruns)} reruns en {duracion:.1f} s")
+    print(f"{'acción':<12}{'n':>6}{'p50 s':>10}{'p95 s':>10}{'p99 s':>10}")
+    for accion, lat in informe['latencia_s'].items():
+        print(f"{accion:<12}{lat['n']:>6}{lat['p50']:>10.3f}{lat['p95']:>10.3f}{lat['p99']:>10.3f}")
+    mem = informe['memoria_mb']
+    print(f"Memoria del proceso: inicial {mem['inicial']:.0f} MB · final {mem['final']:.0f} MB · pico {mem['pico']:.0f} MB · {mem['por_sesion']:.1f} MB/sesión")
+    bd = informe['consultas_bd']
+    print(f"Consultas a la base: {bd['total']} en total · {bd['por_sesion_media']:.1f} por sesión (máx {bd['por_sesion_max']})")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+        print(f"Informe guardado en {args.json}")
+
+
+if __name__ == "__main__":
+    main()